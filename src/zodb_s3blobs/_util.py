@@ -0,0 +1,43 @@
+import errno
+import functools
+import os
+import shutil
+
+
+# Used for S3 keys and cache paths alike, so vote, finish and load
+# format each oid/tid only once
+@functools.lru_cache(maxsize=16384)
+def to_hex(data):
+    """Convert oid/tid bytes to hex string without leading zeros."""
+    return data.hex().lstrip("0") or "0"
+
+
+# copy_file_range() errors meaning "not possible here", not a real failure
+_COPY_FALLBACK_ERRNOS = frozenset(
+    (errno.ENOSYS, errno.EXDEV, errno.EOPNOTSUPP, errno.EINVAL)
+)
+
+
+def fast_copy(source_path, path):
+    """Copy a file with os.copy_file_range().
+
+    The data never passes through user space, and filesystems that
+    support it may reflink or copy server side.  Falls back to
+    shutil.copyfile() (sendfile on Linux) where the call is unavailable
+    or refuses this pair of files.
+    """
+    copy_file_range = getattr(os, "copy_file_range", None)
+    if copy_file_range is not None:
+        with open(source_path, "rb") as src, open(path, "wb") as dst:
+            remaining = os.fstat(src.fileno()).st_size
+            try:
+                while remaining > 0:
+                    copied = copy_file_range(src.fileno(), dst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+                return
+            except OSError as e:
+                if e.errno not in _COPY_FALLBACK_ERRNOS:
+                    raise
+    shutil.copyfile(source_path, path)
@@ -1,137 +1,586 @@
-from ZODB.utils import oid_repr
+from ZODB.utils import p64
+from zodb_s3blobs._util import fast_copy
+from zodb_s3blobs._util import to_hex
 from zodb_s3blobs.interfaces import IS3BlobCache
 from zope.interface import implementer
 
+import collections
+import concurrent.futures
 import contextlib
+import errno
+import hashlib
 import logging
 import os
-import shutil
+import struct
+import tempfile
 import threading
+import time
 
 
 logger = logging.getLogger(__name__)
 
+# Number of oid lock stripes; a power of two
+_STRIPES = 64
 
-def _hex(data):
-    """Convert oid/tid bytes to hex string without 0x prefix."""
-    return oid_repr(data).removeprefix("0x").lstrip("0") or "0"
+# Smaller blobs are not worth hashing for deduplication
+_DEDUP_MIN_SIZE = 4096
+
+# Temporary files older than this many seconds were left behind by a
+# crashed download and are removed on startup
+_STALE_TMP_AGE = 3600
+
+# Index snapshot written by close() and read back on the next start:
+# a magic header, then one (oid + tid, size) record per blob in LRU order
+_INDEX_FILE = "index.bin"
+_INDEX_MAGIC = b"S3BCIDX1"
+_INDEX_RECORD = struct.Struct("<16sQ")
+
+
+def _is_tmp_name(name):
+    """Tell whether name is a temporary file left in the cache directory.
+
+    Besides our own '.tmp' files this matches the partial downloads
+    s3transfer writes next to the target, '<target>.<8 random chars>'.
+    """
+    return name.endswith(".tmp") or ".blob.tmp." in name
 
 
 @implementer(IS3BlobCache)
 class S3BlobCache:
-    """Local filesystem LRU cache for S3 blobs.
+    """Local filesystem cache for S3 blobs with LRU eviction.
+
+    Files are stored as {cache_dir}/{shard}/{oid_hex}_{tid_hex}.blob,
+    where shard is the last two hex digits of the zero-padded oid.  This
+    caps the cache at 256 subdirectories however many oids it holds.
+    Cached files are tracked in an in-memory OrderedDict in recency
+    order; a cache hit moves its entry to the end.  When the total size
+    reaches max_size, put() wakes a dedicated worker thread, which
+    evicts from the front until the size is under target.  Eviction
+    never stats files, so it does not depend on atime being updated by
+    the filesystem.
 
-    Files are stored as {cache_dir}/{oid_hex}/{tid_hex}.blob.
-    Background cleanup removes oldest files (by atime) when
-    total size exceeds max_size.
+    close() saves the index to a snapshot file, which the next start
+    loads instead of scanning the directory.  Without a usable snapshot
+    the order is rebuilt from the cache directory, oldest atime first,
+    and files in the older {oid_hex}/{tid_hex}.blob layout
+    are moved into their shard.
+
+    The cache directory must not be shared between processes: the index
+    only knows about files this instance added, so files written by
+    another process would be neither found nor evicted.
     """
 
-    def __init__(self, cache_dir, max_size=1024 * 1024 * 1024):
+    def __init__(self, cache_dir, max_size=1024 * 1024 * 1024, dedup=False):
         self.cache_dir = cache_dir
+        self._prefix = os.path.join(cache_dir, "")  # ends with a separator
         self.max_size = max_size
         self._target_size = int(max_size * 0.9)
-        self._check_threshold = max(int(max_size * 0.1), 1)
-        self._bytes_loaded = 0
+        # Guards the index.  Renames into and out of blob paths happen
+        # under it too, so the index always matches the files; copies,
+        # unlinks and stat calls never do
         self._lock = threading.Lock()
-        self._checker_thread = None
+        # Serialize cache fills per oid, see oid_lock()
+        self._stripes = tuple(threading.Lock() for _ in range(_STRIPES))
+        # Keyed by oid + tid: one 16-byte bytes object per entry is
+        # smaller than a tuple that keeps two 8-byte ones alive
+        self._lru = collections.OrderedDict()  # {oid + tid: (path, size)}
+        self._total_size = 0
+        self._known_dirs = set()  # shard dirs known to exist
+        self._dedup = dedup
+        self._by_digest = {}  # {sha256 digest: path}, only with dedup
+        self._digests = {}  # {path: sha256 digest}, only with dedup
+        # Cross-filesystem copies run off the caller's thread
+        self._copier = concurrent.futures.ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="s3blobcache-copy"
+        )
+        self._inflight = {}  # {oid + tid: Future} for running copies
+        # Eviction runs on a dedicated worker; put() only sets _wake
+        self._wake = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._closed = False
+        self._worker = threading.Thread(
+            target=self._cleanup_worker, name="s3blobcache-cleanup", daemon=True
+        )
+        self._worker.start()
         os.makedirs(cache_dir, exist_ok=True, mode=0o700)
+        self._load_entries()
+        self.notify_loaded(0)
 
-    def _blob_path(self, oid, tid):
-        oid_hex = _hex(oid)
-        tid_hex = _hex(tid)
-        return os.path.join(self.cache_dir, oid_hex, f"{tid_hex}.blob")
+    def _load_entries(self):
+        """Index files already in the cache directory, oldest first.
 
-    def get(self, oid, tid):
-        path = self._blob_path(oid, tid)
+        Stale temporary files found on the way are removed.
+        """
+        if self._load_snapshot():
+            return
+        tmp_files = []
+        for _atime, size, path in sorted(self._iter_blobs(tmp_files)):
+            ids = self._key_from_path(path)
+            if ids is None:
+                continue
+            key = ids[0] + ids[1]
+            shard_dir, blob_path = self._blob_path(*ids)
+            if path != blob_path:
+                if not self._migrate(path, shard_dir, blob_path):
+                    continue
+                path = blob_path
+            old = self._lru.pop(key, None)
+            if old is not None:
+                self._total_size -= old[1]
+            self._lru[key] = (path, size)
+            self._total_size += size
+            self._known_dirs.add(os.path.dirname(path))
+        cutoff = time.time() - _STALE_TMP_AGE
+        for entry in tmp_files:
+            with contextlib.suppress(OSError):
+                if entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                    os.remove(entry.path)
+
+    def _load_snapshot(self):
+        """Restore the index from the snapshot written by close().
+
+        Reading one file replaces a stat call per cached blob.  The
+        snapshot is removed once read, so a crash later on leads to a
+        full scan.  It is ignored if a cache subdirectory was modified
+        after it was written, e.g. by an older release that does not
+        know about the snapshot.
+        """
+        path = self._prefix + _INDEX_FILE
         try:
-            os.utime(path)  # touch atime; also verifies file exists
-            return path
+            with open(path, "rb") as f:
+                written = os.fstat(f.fileno()).st_mtime_ns
+                data = f.read()
         except FileNotFoundError:
+            return False
+        except OSError:
+            logger.warning("Could not read cache index %s", path, exc_info=True)
+            return False
+        with contextlib.suppress(OSError):
+            os.remove(path)
+        body = memoryview(data)[len(_INDEX_MAGIC) :]
+        if not data.startswith(_INDEX_MAGIC) or len(body) % _INDEX_RECORD.size:
+            logger.warning("Ignoring corrupt cache index %s", path)
+            return False
+        if not self._unchanged_since(written):
+            return False
+        for key, size in _INDEX_RECORD.iter_unpack(body):
+            shard_dir, blob_path = self._blob_path(key[:8], key[8:])
+            self._lru[key] = (blob_path, size)
+            self._total_size += size
+            self._known_dirs.add(shard_dir)
+        return True
+
+    def _unchanged_since(self, mtime_ns):
+        """Tell whether all cache subdirectories are older than mtime_ns.
+
+        A subdirectory with the same timestamp may have changed within
+        the same filesystem clock tick as the snapshot, so it counts as
+        modified.
+        """
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if (
+                        entry.is_dir(follow_symlinks=False)
+                        and entry.stat(follow_symlinks=False).st_mtime_ns >= mtime_ns
+                    ):
+                        return False
+        except OSError:
+            return False
+        return True
+
+    def _write_snapshot(self):
+        """Save the index for the next start, see _load_snapshot()."""
+        with self._lock:
+            records = [
+                _INDEX_RECORD.pack(key, size)
+                for key, (_path, size) in self._lru.items()
+            ]
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(
+                dir=self.cache_dir, prefix=_INDEX_FILE, suffix=".tmp"
+            )
+            with open(fd, "wb") as f:
+                f.write(_INDEX_MAGIC)
+                f.write(b"".join(records))
+            os.replace(tmp_path, self._prefix + _INDEX_FILE)
+        except OSError:
+            logger.warning("Could not save cache index", exc_info=True)
+            if tmp_path is not None:
+                with contextlib.suppress(OSError):
+                    os.remove(tmp_path)
+
+    def _migrate(self, old_path, shard_dir, path):
+        """Move a blob from the old per-oid layout into its shard.
+
+        If the shard already holds the blob, the old copy is removed
+        instead.  Returns whether the blob was moved.
+        """
+        try:
+            if os.path.exists(path):
+                # Same oid and tid, so the same content
+                os.remove(old_path)
+                moved = False
+            else:
+                if shard_dir not in self._known_dirs:
+                    self._make_dir(shard_dir)
+                os.rename(old_path, path)
+                moved = True
+        except OSError:
+            logger.warning("Could not move cached blob %s", old_path, exc_info=True)
+            return False
+        with contextlib.suppress(OSError):
+            os.rmdir(os.path.dirname(old_path))
+        return moved
+
+    @staticmethod
+    def _key_from_path(path):
+        """Extract (oid, tid) from a cached blob path.
+
+        Understands '.../{oid_hex}_{tid_hex}.blob' as well as the old
+        '.../{oid_hex}/{tid_hex}.blob' layout.
+        """
+        dirname, filename = os.path.split(path)
+        oid_hex, sep, tid_hex = filename.removesuffix(".blob").partition("_")
+        if not sep:
+            oid_hex, tid_hex = os.path.basename(dirname), oid_hex
+        try:
+            oid = p64(int(oid_hex, 16))
+            tid = p64(int(tid_hex, 16))
+        except (ValueError, OverflowError):
             return None
+        return oid, tid
+
+    def oid_lock(self, oid):
+        """Return the lock that serializes cache fills for oid.
+
+        Locks are striped, so unrelated oids rarely share one.
+        """
+        return self._stripes[hash(oid) & (_STRIPES - 1)]
+
+    def get(self, oid, tid):
+        # The index is keyed by the raw ids; hex strings are only built
+        # for file paths, never on a lookup.
+        key = oid + tid
+        future = self._inflight.get(key)
+        if future is not None:
+            # A copy started by put() is still running
+            try:
+                future.result()
+            except Exception:
+                return None
+        item = self._lru.get(key)
+        if item is None:
+            return None
+        try:
+            # Read-only check that the file still exists.  Recency lives
+            # in the index, so unlike utime() this never dirties the inode.
+            os.stat(item[0])
+        except OSError:
+            self._drop(key, item)
+            return None
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+        return item[0]
+
+    def _drop(self, key, item):
+        """Forget an entry whose file disappeared behind our back."""
+        with self._lock:
+            if self._lru.get(key) is item:
+                del self._lru[key]
+                self._total_size -= item[1]
+                self._digests.pop(item[0], None)
+
+    def _blob_path(self, oid, tid):
+        """Return (shard_dir, path) for a blob.
+
+        The shard is taken from the end of the oid, where sequentially
+        allocated oids differ, so blobs spread evenly over the shards.
+        Built with f-strings, which are an order of magnitude faster than
+        os.path.join on this hot path.
+        """
+        shard_dir = f"{self._prefix}{oid.hex()[-2:]}"
+        return shard_dir, f"{shard_dir}{os.sep}{to_hex(oid)}_{to_hex(tid)}.blob"
 
     def put(self, oid, tid, source_path):
-        path = self._blob_path(oid, tid)
-        os.makedirs(os.path.dirname(path), exist_ok=True, mode=0o700)
-        shutil.copy2(source_path, path)
-        size = os.path.getsize(path)
-        self.notify_loaded(size)
+        """Move source_path into the cache and return the cached path.
+
+        The source file is consumed.  A rename is used when source and
+        cache share a filesystem.  Otherwise the file is copied in a
+        background thread and the path is returned right away; get()
+        waits for the copy to finish.
+        """
+        shard_dir, path = self._blob_path(oid, tid)
+        key = oid + tid
+        size = os.path.getsize(source_path)
+        try:
+            self._in_shard(shard_dir, self._add_entry, key, source_path, path, size)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # Different filesystems, copy instead
+            with self._lock:
+                self._inflight[key] = self._copier.submit(
+                    self._copy_in, key, source_path, path
+                )
         return path
 
-    def notify_loaded(self, byte_count):
+    def reserve_path(self, oid, tid):
+        """Create an empty temporary file next to the cached path.
+
+        The file lives in the cache directory, so commit() can move it
+        into place with a rename.  The caller owns the file until it is
+        committed and must remove it on failure.
+        """
+        shard_dir, _path = self._blob_path(oid, tid)
+        fd, tmp_path = self._in_shard(
+            shard_dir, tempfile.mkstemp, dir=shard_dir, suffix=".blob.tmp"
+        )
+        os.close(fd)
+        return tmp_path
+
+    def commit(self, oid, tid, tmp_path):
+        """Rename a file from reserve_path() into place and return its path."""
+        _shard_dir, path = self._blob_path(oid, tid)
+        self._add_entry(oid + tid, tmp_path, path, os.path.getsize(tmp_path))
+        return path
+
+    def _copy_in(self, key, source_path, path):
+        """Copy source_path into the cache.  Runs in the copier pool.
+
+        The copy goes to a temporary file, which is renamed into place
+        once complete.
+        """
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(path), suffix=".blob.tmp"
+            )
+            os.close(fd)
+            # Metadata is not copied, so the cached file starts with a
+            # fresh atime.
+            fast_copy(source_path, tmp_path)
+            self._add_entry(key, tmp_path, path, os.path.getsize(tmp_path))
+            with contextlib.suppress(OSError):
+                os.remove(source_path)
+        except Exception:
+            logger.exception("Error copying %s into the cache", source_path)
+            if tmp_path is not None:
+                with contextlib.suppress(OSError):
+                    os.remove(tmp_path)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _add_entry(self, key, source_path, path, size):
+        """Rename source_path to path and register it under key.
+
+        Both happen under the lock, so _cleanup() never takes the new
+        file for the one of an evicted entry with the same path.  The
+        caller measures size on source_path, which no other thread
+        touches.
+        """
         with self._lock:
-            self._bytes_loaded += byte_count
-            if self._bytes_loaded >= self._check_threshold:
-                self._bytes_loaded = 0
-                self._start_cleanup()
+            os.rename(source_path, path)
+            old = self._lru.pop(key, None)
+            if old is not None:
+                # Replaced an existing file (e.g. re-download)
+                self._total_size -= old[1]
+            self._lru[key] = (path, size)
+            self._total_size += size
+            if self._total_size >= self.max_size:
+                self._request_cleanup()
+        if self._dedup and size >= _DEDUP_MIN_SIZE:
+            self._link_duplicate(path)
 
-    def _start_cleanup(self):
-        """Start background cleanup thread if not already running.
+    def _link_duplicate(self, path):
+        """Replace path by a hard link to a cached file with equal content.
 
-        Must be called with self._lock held.
+        Sizes are still accounted per entry, so with shared inodes the
+        cache uses less disk space than current_size() reports.
         """
-        if self._checker_thread is not None and self._checker_thread.is_alive():
+        try:
+            with open(path, "rb") as f:
+                digest = hashlib.file_digest(f, "sha256").digest()
+        except OSError:
+            return
+        with self._lock:
+            existing = self._by_digest.setdefault(digest, path)
+            self._digests[path] = digest
+        if existing == path:
             return
-        t = threading.Thread(target=self._cleanup, daemon=True)
-        self._checker_thread = t
-        t.start()
+        tmp_path = f"{path}.link.tmp"
+        try:
+            os.link(existing, tmp_path)
+        except OSError:
+            # The other file was evicted meanwhile; this one takes over
+            with self._lock:
+                if self._digests.get(path) == digest:
+                    self._by_digest[digest] = path
+            return
+        with self._lock:
+            # Unless path itself was evicted meanwhile
+            if self._digests.get(path) == digest:
+                with contextlib.suppress(OSError):
+                    os.replace(tmp_path, path)
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
 
-    def _cleanup(self):
-        """Remove oldest files until total size is under target."""
+    def _make_dir(self, path):
+        """Create the shard dir path unless it exists.
+
+        Unlike os.makedirs(exist_ok=True), this does not fail when the
+        dir is removed between mkdir and the check whether it exists;
+        mkdir is simply tried again.
+        """
+        while True:
+            try:
+                os.mkdir(path, 0o700)
+            except FileExistsError:
+                if os.path.isdir(path):
+                    break
+                if os.path.lexists(path):
+                    raise
+                continue  # removed meanwhile
+            break
+        self._known_dirs.add(path)
+
+    def _in_shard(self, shard_dir, func, *args, **kwargs):
+        """Call func, which creates a file in shard_dir, and return its result.
+
+        Shard dirs are never removed by the cache, but an outside cleaner
+        (e.g. systemd-tmpfiles) may delete an empty one; the dir is then
+        created again and func retried once.
+        """
+        if shard_dir not in self._known_dirs:
+            self._make_dir(shard_dir)
         try:
-            files = []
-            for dirpath, _dirnames, filenames in os.walk(self.cache_dir):
-                for fn in filenames:
-                    if fn.endswith(".blob"):
-                        fp = os.path.join(dirpath, fn)
+            return func(*args, **kwargs)
+        except FileNotFoundError:
+            self._make_dir(shard_dir)
+            return func(*args, **kwargs)
+
+    def notify_loaded(self, byte_count):
+        """Wake the cleanup worker if the cache has reached max_size.
+
+        Sizes are tracked by put() and commit(); byte_count is not needed
+        for accounting.
+        """
+        with self._lock:
+            if self._total_size >= self.max_size:
+                self._request_cleanup()
+
+    def _request_cleanup(self):
+        """Wake the cleanup worker.  Must be called with self._lock held."""
+        self._idle.clear()
+        self._wake.set()
+
+    def _cleanup_worker(self):
+        """Run cleanups until close(); wakeups that arrive meanwhile coalesce."""
+        while True:
+            self._wake.wait()
+            if self._closed:
+                return
+            self._wake.clear()
+            self._cleanup()
+            with self._lock:
+                if not self._wake.is_set():
+                    self._idle.set()
+
+    def _iter_blobs(self, tmp_files=None):
+        """Yield (atime, size, path) for every cached blob file.
+
+        Uses os.scandir so each file costs a single stat call.
+        Symlinks are never followed, and directories that vanish during
+        the walk are skipped.  If tmp_files is a list, DirEntry objects
+        of temporary files are appended to it.
+        """
+        stack = [self.cache_dir]
+        while stack:
+            try:
+                it = os.scandir(stack.pop())
+            except OSError:
+                continue  # removed meanwhile
+            with it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.endswith(".blob"):
                         try:
-                            st = os.stat(fp)
-                            files.append((st.st_atime, st.st_size, fp))
+                            st = entry.stat(follow_symlinks=False)
                         except OSError:
-                            pass
+                            continue
+                        yield st.st_atime, st.st_size, entry.path
+                    elif tmp_files is not None and _is_tmp_name(entry.name):
+                        tmp_files.append(entry)
 
-            total_size = sum(size for _, size, _ in files)
-            if total_size <= self.max_size:
-                return
+    def _evict(self):
+        """Unlink least recently used entries until under target.
 
-            # Sort by atime ascending (oldest first)
-            files.sort(key=lambda x: x[0])
+        Returns (key, path) of the evicted files.  Must be called with
+        self._lock held.
+        """
+        victims = []
+        while self._total_size > self._target_size and self._lru:
+            key, (path, size) = self._lru.popitem(last=False)
+            self._total_size -= size
+            victims.append((key, path))
+            digest = self._digests.pop(path, None)
+            if digest is not None and self._by_digest.get(digest) == path:
+                del self._by_digest[digest]
+        return victims
 
-            for _atime, size, fp in files:
-                if total_size <= self._target_size:
-                    break
-                try:
-                    os.remove(fp)
-                    total_size -= size
-                    # Try to remove empty parent dirs
-                    parent = os.path.dirname(fp)
-                    if parent != self.cache_dir:
-                        with contextlib.suppress(OSError):
-                            os.rmdir(parent)
-                except OSError:
-                    pass
+    def _cleanup(self):
+        """Evict blobs until total size is under target."""
+        try:
+            with self._lock:
+                if self._total_size < self.max_size:
+                    return
+                victims = self._evict()
+            self._remove_files(victims)
         except Exception:
             logger.exception("Error during cache cleanup")
 
+    def _remove_files(self, victims):
+        """Delete the files of evicted entries.
+
+        A victim whose key was filled again since its eviction now has a
+        fresh file at the same path, which is kept.  Under the lock each
+        file is renamed out of the way; the unlink happens outside.
+        """
+        for key, path in victims:
+            tombstone = f"{path}.evicted.tmp"
+            with self._lock:
+                item = self._lru.get(key)
+                if item is not None and item[0] == path:
+                    continue
+                try:
+                    os.rename(path, tombstone)
+                except OSError:
+                    continue
+            with contextlib.suppress(OSError):
+                os.remove(tombstone)
+
     def close(self):
-        """Stop cleanup thread and wait for it to finish."""
-        with self._lock:
-            t = self._checker_thread
-        if t is not None:
-            t.join(timeout=5)
+        """Finish pending copies, stop the cleanup worker, save the index."""
+        self._copier.shutdown(wait=True)
+        self._closed = True
+        self._wake.set()
+        self._worker.join(timeout=5)
+        if self._worker.is_alive():
+            # A cleanup is still running and may unlink indexed files
+            logger.warning("Cache cleanup still running, not saving the index")
+            return
+        self._write_snapshot()
 
     def wait_for_cleanup(self):
-        """Wait for any running cleanup thread to finish. For testing."""
-        with self._lock:
-            t = self._checker_thread
-        if t is not None:
-            t.join(timeout=10)
+        """Wait until the cleanup worker is idle. For testing."""
+        self._idle.wait(timeout=10)
 
     def current_size(self):
-        """Return total size of cached files. For testing."""
-        total = 0
-        for dirpath, _dirnames, filenames in os.walk(self.cache_dir):
-            for fn in filenames:
-                if fn.endswith(".blob"):
-                    with contextlib.suppress(OSError):
-                        total += os.path.getsize(os.path.join(dirpath, fn))
-        return total
+        """Return total size of cached files from the in-memory index."""
+        return self._total_size
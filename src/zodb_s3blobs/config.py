@@ -26,5 +26,11 @@ class S3BlobStorageFactory(BaseConfig):
         cache = S3BlobCache(
             cache_dir=config.cache_dir,
             max_size=config.cache_size,
+            dedup=config.cache_dedup,
+        )
+        return S3BlobStorage(
+            base,
+            s3_client,
+            cache,
+            max_upload_concurrency=config.upload_concurrency,
         )
-        return S3BlobStorage(base, s3_client, cache)
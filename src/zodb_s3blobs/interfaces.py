@@ -13,6 +13,9 @@ class IS3Client(Interface):
     def delete_object(s3_key):
         """Delete an S3 object."""
 
+    def delete_objects(s3_keys):
+        """Delete many S3 objects using batched requests."""
+
     def head_object(s3_key):
         """Return metadata dict for an S3 object, or None if not found."""
 
@@ -27,10 +30,23 @@ class IS3BlobCache(Interface):
         """Return cached file path or None."""
 
     def put(oid, tid, source_path):
-        """Copy source file into cache."""
+        """Move source file into cache and return the cached path.
+
+        The file may still be copying in the background; get() waits
+        for it to be complete.
+        """
+
+    def oid_lock(oid):
+        """Return a lock that serializes cache fills for oid."""
+
+    def reserve_path(oid, tid):
+        """Create a temporary file in the cache and return its path."""
+
+    def commit(oid, tid, tmp_path):
+        """Move a reserved file into place and return the cached path."""
 
     def notify_loaded(byte_count):
-        """Track loaded bytes and trigger cleanup if threshold exceeded."""
+        """Trigger cleanup if the cache exceeds its maximum size."""
 
 
 class IS3BlobStorage(Interface):
@@ -1,3 +1,5 @@
+from boto3.s3.transfer import create_transfer_manager
+from boto3.s3.transfer import TransferConfig
 from botocore.config import Config
 from botocore.exceptions import ClientError
 from zodb_s3blobs.interfaces import IS3Client
@@ -5,23 +7,38 @@ from zope.interface import implementer
 
 import base64
 import boto3
-import contextlib
+import itertools
 import logging
 import os
 import re
-import tempfile
 
 
 logger = logging.getLogger(__name__)
 
+# S3 DeleteObjects accepts at most 1000 keys per request
+_DELETE_BATCH_SIZE = 1000
+
+# Error codes S3 uses for a missing key, depending on the operation
+_NOT_FOUND_CODES = frozenset(("404", "NoSuchKey"))
+
 
 class S3OperationError(Exception):
     """Wraps boto3 ClientError to avoid leaking AWS infrastructure details."""
 
 
+class S3NotFoundError(S3OperationError):
+    """The requested key does not exist."""
+
+
 @implementer(IS3Client)
 class S3Client:
-    """Thin boto3 wrapper for S3-compatible object storage."""
+    """Thin boto3 wrapper for S3-compatible object storage.
+
+    Thread-safe: the boto3 client and the transfer manager may be used
+    from several threads.  One instance is meant to be shared by a
+    storage and all its MVCC instances, so they share one connection
+    pool.
+    """
 
     def __init__(
         self,
@@ -36,6 +53,9 @@ class S3Client:
         connect_timeout=60,
         read_timeout=60,
         sse_customer_key=None,
+        max_pool_connections=50,
+        multipart_threshold=8 * 1024 * 1024,
+        max_concurrency=10,
     ):
         self.bucket_name = bucket_name
         self._prefix = prefix.rstrip("/") if prefix else ""
@@ -49,6 +69,8 @@ class S3Client:
                 )
             if ".." in self._prefix:
                 raise ValueError(f"s3-prefix must not contain '..': {self._prefix!r}")
+        # Joined to every key, so build "{prefix}/" once
+        self._prefix_with_sep = f"{self._prefix}/" if self._prefix else ""
 
         # SSE-C setup
         if sse_customer_key:
@@ -66,10 +88,27 @@ class S3Client:
         else:
             self._sse_extra_args = {}
 
+        # Blobs from multipart_threshold bytes on are transferred as
+        # parallel multipart parts / ranges
+        transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=8 * 1024 * 1024,
+            max_concurrency=max_concurrency,
+        )
+
+        # The pool is shared by parallel uploads, multipart parts and all
+        # MVCC instances; botocore's default of 10 connections is quickly
+        # exhausted.  Keep-alive avoids paying a new TCP/TLS handshake for
+        # every small blob.
         config = Config(
             s3={"addressing_style": addressing_style},
             connect_timeout=connect_timeout,
             read_timeout=read_timeout,
+            max_pool_connections=max(
+                max_pool_connections, transfer_config.max_concurrency
+            ),
+            tcp_keepalive=True,
+            retries={"mode": "adaptive", "max_attempts": 5},
         )
 
         kwargs = {"config": config}
@@ -88,60 +127,87 @@ class S3Client:
             )
 
         self._client = boto3.client("s3", **kwargs)
+        # One transfer manager for all calls; client.upload_file() and
+        # download_file() would build a new one, with its thread pools,
+        # for every blob.
+        self._transfer = create_transfer_manager(self._client, transfer_config)
 
     def _full_key(self, s3_key):
-        if self._prefix:
-            return f"{self._prefix}/{s3_key}"
-        return s3_key
+        return self._prefix_with_sep + s3_key
 
     def _wrap_client_error(self, e, operation, s3_key):
         """Wrap ClientError in a generic error, logging the original at DEBUG."""
         logger.debug("S3 %s failed for key=%s: %s", operation, s3_key, e)
-        raise S3OperationError(
-            f"S3 {operation} failed for key={s3_key}: "
-            f"{e.response['Error'].get('Code', 'Unknown')}"
-        ) from e
+        code = e.response["Error"].get("Code", "Unknown")
+        error_class = S3NotFoundError if code in _NOT_FOUND_CODES else S3OperationError
+        raise error_class(f"S3 {operation} failed for key={s3_key}: {code}") from e
 
     def upload_file(self, local_path, s3_key):
         full_key = self._full_key(s3_key)
         try:
-            self._client.upload_file(
+            self._transfer.upload(
                 local_path,
                 self.bucket_name,
                 full_key,
-                ExtraArgs=self._sse_extra_args or None,
-            )
+                extra_args=self._sse_extra_args or None,
+            ).result()
         except ClientError as e:
             self._wrap_client_error(e, "upload", s3_key)
 
     def download_file(self, s3_key, local_path):
+        """Stream an object to local_path.
+
+        The transfer manager writes the body in chunks to a temporary file
+        next to local_path and renames it into place when complete, so
+        local_path never holds a partial download.
+        """
         full_key = self._full_key(s3_key)
         target_dir = os.path.dirname(local_path) or "."
         os.makedirs(target_dir, exist_ok=True, mode=0o700)
-        fd, tmp_path = tempfile.mkstemp(dir=target_dir, suffix=".blob.tmp")
         try:
-            os.close(fd)
+            self._transfer.download(
+                self.bucket_name,
+                full_key,
+                local_path,
+                extra_args=self._sse_extra_args or None,
+            ).result()
+        except ClientError as e:
+            self._wrap_client_error(e, "download", s3_key)
+
+    def delete_object(self, s3_key):
+        self.delete_objects([s3_key])
+
+    def delete_objects(self, s3_keys):
+        """Delete many S3 objects, up to 1000 keys per request.
+
+        All batches are attempted; if any key could not be deleted, an
+        S3OperationError is raised at the end.  Keys that do not exist
+        are not an error.
+        """
+        failed = 0
+        first_code = None
+        for batch in itertools.batched(s3_keys, _DELETE_BATCH_SIZE):
+            objects = [{"Key": self._full_key(k)} for k in batch]
             try:
-                self._client.download_file(
-                    self.bucket_name,
-                    full_key,
-                    tmp_path,
-                    ExtraArgs=self._sse_extra_args or None,
+                response = self._client.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={"Objects": objects, "Quiet": True},
                 )
             except ClientError as e:
-                self._wrap_client_error(e, "download", s3_key)
-            os.rename(tmp_path, local_path)
-        except BaseException:
-            with contextlib.suppress(OSError):
-                os.unlink(tmp_path)
-            raise
-
-    def delete_object(self, s3_key):
-        full_key = self._full_key(s3_key)
-        try:
-            self._client.delete_object(Bucket=self.bucket_name, Key=full_key)
-        except ClientError as e:
-            self._wrap_client_error(e, "delete", s3_key)
+                logger.debug("S3 batch delete failed for %d keys: %s", len(batch), e)
+                failed += len(batch)
+                first_code = first_code or e.response["Error"].get("Code", "Unknown")
+                continue
+            for error in response.get("Errors", []):
+                if error.get("Code") in _NOT_FOUND_CODES:
+                    continue  # already gone, which is what we want
+                logger.debug("S3 delete failed for key=%s: %s", error.get("Key"), error)
+                failed += 1
+                first_code = first_code or error.get("Code", "Unknown")
+        if failed:
+            raise S3OperationError(
+                f"S3 delete failed for {failed} key(s): {first_code}"
+            )
 
     def head_object(self, s3_key):
         full_key = self._full_key(s3_key)
@@ -155,12 +221,14 @@ class S3Client:
             self._wrap_client_error(e, "head", s3_key)
 
     def list_objects(self, prefix=""):
-        full_prefix = self._full_key(prefix) if prefix else self._prefix
+        """Yield keys under prefix, fetching one page of 1000 at a time."""
+        # With the separator, prefix "a" never matches keys of prefix "ab"
+        full_prefix = self._full_key(prefix)
         paginator = self._client.get_paginator("list_objects_v2")
-        prefix_len = len(self._prefix) + 1 if self._prefix else 0
+        prefix_len = len(self._prefix_with_sep)
         try:
             for page in paginator.paginate(Bucket=self.bucket_name, Prefix=full_prefix):
-                for obj in page.get("Contents", []):
+                for obj in page.get("Contents", ()):
                     key = obj["Key"]
                     # Strip the prefix so callers see logical keys
                     if prefix_len:
@@ -169,3 +237,7 @@ class S3Client:
                         yield key
         except ClientError as e:
             self._wrap_client_error(e, "list", prefix)
+
+    def close(self):
+        """Shut down the transfer manager's worker threads."""
+        self._transfer.shutdown()
@@ -1,10 +1,19 @@
+from zodb_s3blobs._util import fast_copy
+from zodb_s3blobs._util import to_hex
+from zodb_s3blobs.s3client import S3NotFoundError
+
+import collections
+import concurrent.futures
 import contextlib
+import errno
 import logging
 import os
-import re
 import shutil
 import tempfile
+import threading
+import time
 import ZODB.blob
+import ZODB.FileStorage
 import ZODB.interfaces
 import ZODB.POSException
 import ZODB.utils
@@ -13,7 +22,26 @@ import zope.interface
 
 logger = logging.getLogger(__name__)
 
-_BLOB_KEY_RE = re.compile(r"^blobs/([0-9a-f]+)/[0-9a-f]+\.blob$")
+# Valid blob keys match ^blobs/([0-9a-f]+)/[0-9a-f]+\.blob$; _oid_from_key
+# checks this with str operations, which are much faster than a regex.
+_HEX_DIGITS = "0123456789abcdef"
+
+# Default upper bound for concurrent blob uploads in tpc_vote
+_MAX_UPLOAD_WORKERS = 8
+
+# Number of threads downloading blobs requested by prefetch()
+_MAX_PREFETCH_WORKERS = 16
+
+# Orphaned keys are deleted in batches of this size during pack GC
+_GC_DELETE_BATCH_SIZE = 1000
+
+# Upper bound for batch deletes running concurrently during pack GC
+_GC_DELETE_WORKERS = 8
+
+# Blobs found missing in S3 are remembered for this many seconds, so
+# repeated loads fail without a request; at most _MISSING_MAX of them
+_MISSING_TTL = 30
+_MISSING_MAX = 1024
 
 
 @zope.interface.implementer(ZODB.interfaces.IBlobStorage)
@@ -25,7 +53,15 @@ class S3BlobStorage:
     storage's methods (if any).
     """
 
-    def __init__(self, base_storage, s3_client, cache, temp_dir=None):
+    def __init__(
+        self,
+        base_storage,
+        s3_client,
+        cache,
+        temp_dir=None,
+        max_upload_concurrency=_MAX_UPLOAD_WORKERS,
+        _parent=None,
+    ):
         self.__storage = base_storage
         self._s3_client = s3_client
         self._cache = cache
@@ -33,6 +69,25 @@ class S3BlobStorage:
         self._uploaded_keys = []  # [(oid, tid, s3_key)]
         self._temp_dir = temp_dir or tempfile.mkdtemp()
         os.makedirs(self._temp_dir, exist_ok=True, mode=0o700)
+        # MVCC instances (created with _parent) share the S3 client, cache,
+        # thread pools and missing-blob cache; only the main storage closes them
+        self._owns_shared = _parent is None
+        if self._owns_shared:
+            self._upload_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max_upload_concurrency,
+                thread_name_prefix="s3blobs-upload",
+            )
+            self._prefetch_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=_MAX_PREFETCH_WORKERS,
+                thread_name_prefix="s3blobs-prefetch",
+            )
+            self._missing = collections.OrderedDict()  # {(oid, tid): expiry}
+            self._missing_lock = threading.Lock()
+        else:
+            self._upload_pool = _parent._upload_pool
+            self._prefetch_pool = _parent._prefetch_pool
+            self._missing = _parent._missing
+            self._missing_lock = _parent._missing_lock
 
     def __getattr__(self, name):
         return getattr(self.__storage, name)
@@ -49,11 +104,31 @@ class S3BlobStorage:
         # Store object data (pickle) in base storage
         self.__storage.store(oid, oldserial, data, "", transaction)
         # Stage blob locally
-        oid_hex = _oid_hex(oid)
-        staged_path = os.path.join(self._temp_dir, f"{oid_hex}.blob")
-        shutil.move(blobfilename, staged_path)
+        staged_path = os.path.join(self._temp_dir, f"{to_hex(oid)}.blob")
+        self._stage(blobfilename, staged_path)
         self._pending_blobs[oid] = staged_path
 
+    @staticmethod
+    def _stage(blobfilename, staged_path):
+        """Move a blob file into the temp dir, consuming the source.
+
+        A rename on the same filesystem; otherwise a copy with
+        copy_file_range(), which may reflink, and no metadata copy.
+        """
+        try:
+            os.rename(blobfilename, staged_path)
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+        try:
+            fast_copy(blobfilename, staged_path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(staged_path)
+            raise
+        os.remove(blobfilename)
+
     def loadBlob(self, oid, serial):
         # Check pending blobs first (stored in current txn, not yet in S3)
         pending = self._pending_blobs.get(oid)
@@ -64,21 +139,51 @@ class S3BlobStorage:
         cached = self._cache.get(oid, serial)
         if cached is not None:
             return cached
-
-        # Download from S3
-        key = self._s3_key(oid, serial)
-        meta = self._s3_client.head_object(key)
-        if meta is None:
+        if self._recently_missing(oid, serial):
             raise ZODB.POSException.POSKeyError(oid, serial)
 
-        # Download to temp, put in cache
-        tmp_download = os.path.join(self._temp_dir, f"dl_{_oid_hex(oid)}.tmp")
-        self._s3_client.download_file(key, tmp_download)
-        path = self._cache.put(oid, serial, tmp_download)
-        # Clean up temp download
-        with contextlib.suppress(OSError):
-            os.remove(tmp_download)
-        return path
+        # Concurrent misses for the same oid download it only once
+        with self._cache.oid_lock(oid):
+            cached = self._cache.get(oid, serial)
+            if cached is not None:
+                return cached
+            return self._download(oid, serial)
+
+    def _download(self, oid, serial):
+        """Download a blob straight into the cache directory.
+
+        A missing key surfaces from the download itself, which saves a
+        HEAD round-trip per cache miss.
+        """
+        tmp_path = self._cache.reserve_path(oid, serial)
+        try:
+            self._s3_client.download_file(self._s3_key(oid, serial), tmp_path)
+            return self._cache.commit(oid, serial, tmp_path)
+        except BaseException as e:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            if isinstance(e, S3NotFoundError):
+                self._remember_missing(oid, serial)
+                raise ZODB.POSException.POSKeyError(oid, serial) from e
+            raise
+
+    def _recently_missing(self, oid, serial):
+        expiry = self._missing.get((oid, serial))
+        if expiry is None:
+            return False
+        if time.monotonic() < expiry:
+            return True
+        with self._missing_lock:
+            if self._missing.get((oid, serial)) == expiry:
+                del self._missing[(oid, serial)]
+        return False
+
+    def _remember_missing(self, oid, serial):
+        with self._missing_lock:
+            self._missing[(oid, serial)] = time.monotonic() + _MISSING_TTL
+            self._missing.move_to_end((oid, serial))
+            if len(self._missing) > _MISSING_MAX:
+                self._missing.popitem(last=False)
 
     def openCommittedBlobFile(self, oid, serial, blob=None):
         filename = self.loadBlob(oid, serial)
@@ -86,6 +191,29 @@ class S3BlobStorage:
             return open(filename, "rb")
         return ZODB.blob.BlobFile(filename, "r", blob)
 
+    def prefetch(self, pairs):
+        """Start loading the blobs for (oid, serial) pairs into the cache.
+
+        Meant for callers that know they are about to read several blobs;
+        returns at once, with one future per pair.  A loadBlob() of a blob
+        being prefetched waits for that download instead of starting
+        another.  Best effort: failures are logged and left to a later
+        loadBlob.
+        """
+        submit = self._prefetch_pool.submit
+        return [submit(self._prefetch_one, oid, serial) for oid, serial in pairs]
+
+    def _prefetch_one(self, oid, serial):
+        try:
+            self.loadBlob(oid, serial)
+        except Exception:
+            logger.warning(
+                "Failed to prefetch blob for oid=%s tid=%s",
+                to_hex(oid),
+                to_hex(serial),
+                exc_info=True,
+            )
+
     def temporaryDirectory(self):
         return self._temp_dir
 
@@ -95,27 +223,67 @@ class S3BlobStorage:
         self.__storage.tpc_vote(transaction)
         # _tid is now available from base storage via __getattr__
         tid = self._tid
-        for oid, staged_path in self._pending_blobs.items():
-            key = self._s3_key(oid, tid)
+        uploads = [
+            (oid, staged_path, self._s3_key(oid, tid))
+            for oid, staged_path in self._pending_blobs.items()
+        ]
+        if len(uploads) == 1:
+            oid, staged_path, key = uploads[0]
             self._s3_client.upload_file(staged_path, key)
             self._uploaded_keys.append((oid, tid, key))
+        elif uploads:
+            self._upload_parallel(uploads, tid)
+
+    def _upload_parallel(self, uploads, tid):
+        """Upload several staged blobs concurrently.
+
+        boto3 releases the GIL during network I/O, so threads overlap the
+        round-trips.  The pool lives as long as the storage, so its threads
+        are reused across transactions.  Uploads are still joined here:
+        a failure must make the vote fail.  Keys of successful uploads are
+        recorded for tpc_abort; the first error is re-raised once all
+        uploads settled.
+        """
+        error = None
+        submit = self._upload_pool.submit
+        futures = [
+            (oid, key, submit(self._s3_client.upload_file, path, key))
+            for oid, path, key in uploads
+        ]
+        for oid, key, future in futures:
+            if future.cancelled():
+                continue
+            try:
+                future.result()
+            except Exception as e:
+                if error is None:
+                    error = e
+                    for _oid, _key, pending in futures:
+                        pending.cancel()
+                continue
+            self._uploaded_keys.append((oid, tid, key))
+        if error is not None:
+            raise error
 
     def tpc_finish(self, transaction, func=lambda tid: None):
         tid = self.__storage.tpc_finish(transaction, func)
         # Move staged files into cache (NO S3 ops - must not fail)
         for oid, staged_path in self._pending_blobs.items():
+            if self._missing:
+                with self._missing_lock:
+                    self._missing.pop((oid, tid), None)
             try:
+                # put() consumes the staged file, possibly in the background
                 self._cache.put(oid, tid, staged_path)
             except Exception:
                 logger.warning(
                     "Failed to cache blob for oid=%s tid=%s",
-                    _oid_hex(oid),
-                    _tid_hex(tid),
+                    to_hex(oid),
+                    to_hex(tid),
                     exc_info=True,
                 )
-            # Clean staged file
-            with contextlib.suppress(OSError):
-                os.remove(staged_path)
+                with contextlib.suppress(OSError):
+                    os.remove(staged_path)
         self._pending_blobs = {}
         self._uploaded_keys = []
         return tid
@@ -123,12 +291,13 @@ class S3BlobStorage:
     def tpc_abort(self, transaction):
         self.__storage.tpc_abort(transaction)
         # Delete uploaded S3 keys (best-effort)
-        for _oid, _tid, key in self._uploaded_keys:
+        keys = [key for _oid, _tid, key in self._uploaded_keys]
+        if keys:
             try:
-                self._s3_client.delete_object(key)
+                self._s3_client.delete_objects(keys)
             except Exception:
                 logger.warning(
-                    "Failed to delete S3 key %s during abort", key, exc_info=True
+                    "Failed to delete S3 keys %s during abort", keys, exc_info=True
                 )
         # Clean staged files
         for _oid, staged_path in self._pending_blobs.items():
@@ -144,13 +313,21 @@ class S3BlobStorage:
         base = new_instance() if new_instance is not None else self.__storage
         # Each MVCC instance gets its own temp dir to avoid file name collisions
         instance_temp = tempfile.mkdtemp(dir=self._temp_dir)
-        return S3BlobStorage(base, self._s3_client, self._cache, instance_temp)
+        return S3BlobStorage(
+            base, self._s3_client, self._cache, instance_temp, _parent=self
+        )
 
     def close(self):
         self.__storage.close()
-        close_cache = getattr(self._cache, "close", None)
-        if close_cache is not None:
-            close_cache()
+        if self._owns_shared:
+            self._upload_pool.shutdown()
+            self._prefetch_pool.shutdown(cancel_futures=True)
+            close_cache = getattr(self._cache, "close", None)
+            if close_cache is not None:
+                close_cache()
+            close_client = getattr(self._s3_client, "close", None)
+            if close_client is not None:
+                close_client()
         with contextlib.suppress(OSError):
             shutil.rmtree(self._temp_dir)
 
@@ -159,42 +336,87 @@ class S3BlobStorage:
     def pack(self, pack_time, referencesf):
         # Pack the base storage first
         self.__storage.pack(pack_time, referencesf)
-        # GC: remove S3 keys for unreachable OIDs
-        for key in self._s3_client.list_objects("blobs/"):
-            oid = self._oid_from_key(key)
-            if oid is None:
-                continue
-            try:
-                self.__storage.load(oid)
-            except ZODB.POSException.POSKeyError:
+        # GC: remove S3 keys for unreachable OIDs.  Keys are listed in
+        # lexical order, so all tids of an oid arrive together and each oid
+        # is checked only once.  Full batches are deleted by a thread pool
+        # while the listing goes on; at most _GC_DELETE_WORKERS batches
+        # are held in memory.
+        oid_exists = self._oid_exists_checker()
+        orphans = []
+        last_oid = last_exists = None
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=_GC_DELETE_WORKERS, thread_name_prefix="s3blobs-gc"
+        ) as executor:
+            pending = set()
+            for key in self._s3_client.list_objects("blobs/"):
+                oid = self._oid_from_key(key)
+                if oid is None:
+                    continue
+                if oid != last_oid:
+                    last_oid, last_exists = oid, oid_exists(oid)
+                if last_exists:
+                    continue
                 logger.info("GC: removing orphaned S3 key %s", key)
-                try:
-                    self._s3_client.delete_object(key)
-                except Exception:
-                    logger.warning("GC: failed to delete S3 key %s", key, exc_info=True)
+                orphans.append(key)
+                if len(orphans) >= _GC_DELETE_BATCH_SIZE:
+                    if len(pending) >= _GC_DELETE_WORKERS:
+                        _done, pending = concurrent.futures.wait(
+                            pending, return_when=concurrent.futures.FIRST_COMPLETED
+                        )
+                    pending.add(executor.submit(self._delete_orphans, orphans))
+                    orphans = []
+            # The last batch runs here; this thread waits for the pool anyway
+            if orphans:
+                self._delete_orphans(orphans)
+
+    def _oid_exists_checker(self):
+        """Return a callable telling whether an oid exists in the base storage.
+
+        FileStorage keeps every current oid in its in-memory index, so a
+        membership test replaces loading the object.  Other storages fall
+        back to load().
+        """
+        if isinstance(self.__storage, ZODB.FileStorage.FileStorage):
+            return self.__storage._index.__contains__
+        return self._oid_loadable
+
+    def _oid_loadable(self, oid):
+        try:
+            self.__storage.load(oid)
+        except ZODB.POSException.POSKeyError:
+            return False
+        return True
+
+    def _delete_orphans(self, keys):
+        try:
+            self._s3_client.delete_objects(keys)
+        except Exception:
+            logger.warning(
+                "GC: failed to delete %d orphaned S3 keys", len(keys), exc_info=True
+            )
 
     @staticmethod
     def _oid_from_key(key):
         """Extract oid bytes from S3 key like 'blobs/{oid_hex}/{tid_hex}.blob'."""
-        m = _BLOB_KEY_RE.match(key)
-        if m is None:
+        parts = key.split("/")
+        if len(parts) != 3 or parts[0] != "blobs":
+            return None
+        oid_hex = parts[1]
+        tid_hex = parts[2].removesuffix(".blob")
+        if (
+            tid_hex == parts[2]
+            or not oid_hex
+            or not tid_hex
+            or oid_hex.strip(_HEX_DIGITS)
+            or tid_hex.strip(_HEX_DIGITS)
+        ):
             return None
         try:
-            return ZODB.utils.p64(int(m.group(1), 16))
+            return ZODB.utils.p64(int(oid_hex, 16))
         except (ValueError, OverflowError):
             return None
 
     # -- Helpers --
 
     def _s3_key(self, oid, tid):
-        return f"blobs/{_oid_hex(oid)}/{_tid_hex(tid)}.blob"
-
-
-def _oid_hex(oid):
-    """Convert oid bytes to hex string."""
-    return ZODB.utils.oid_repr(oid).removeprefix("0x").lstrip("0") or "0"
-
-
-def _tid_hex(tid):
-    """Convert tid bytes to hex string."""
-    return ZODB.utils.tid_repr(tid).removeprefix("0x").lstrip("0") or "0"
+        return f"blobs/{to_hex(oid)}/{to_hex(tid)}.blob"
@@ -0,0 +1,44 @@
+from moto import mock_aws
+
+import boto3
+import errno
+import os
+import pytest
+
+
+@pytest.fixture
+def cross_device(monkeypatch):
+    """Make os.rename between directories fail as if across filesystems.
+
+    Renames within one directory still work.
+    """
+    original = os.rename
+
+    def rename(src, dst):
+        if os.path.dirname(src) != os.path.dirname(dst):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        original(src, dst)
+
+    monkeypatch.setattr(os, "rename", rename)
+
+
+@pytest.fixture(scope="module")
+def s3_bucket():
+    """A mocked S3 with "test-bucket", started once per test module."""
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="test-bucket")
+        yield s3
+
+
+@pytest.fixture
+def s3_env(s3_bucket):
+    yield
+    # The bucket outlives the test; leave it empty for the next one
+    paginator = s3_bucket.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket="test-bucket"):
+        objects = [{"Key": obj["Key"]} for obj in page.get("Contents", ())]
+        if objects:
+            s3_bucket.delete_objects(
+                Bucket="test-bucket", Delete={"Objects": objects, "Quiet": True}
+            )
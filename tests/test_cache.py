@@ -2,11 +2,14 @@ from ZODB.utils import p64
 from zodb_s3blobs.cache import S3BlobCache
 from zodb_s3blobs.interfaces import IS3BlobCache
 
+import contextlib
+import errno
 import os
 import pytest
 import stat
 import threading
 import time
+import zodb_s3blobs.cache
 
 
 def _make_oid(n):
@@ -19,20 +22,56 @@ def _make_tid(n):
 
 @pytest.fixture
 def cache(tmp_path):
-    return S3BlobCache(str(tmp_path / "cache"), max_size=1024 * 1024)
+    cache = S3BlobCache(str(tmp_path / "cache"), max_size=1024 * 1024)
+    yield cache
+    cache.close()
 
 
 @pytest.fixture
 def small_cache(tmp_path):
     """Cache with very small max_size for eviction tests."""
-    return S3BlobCache(str(tmp_path / "cache"), max_size=500)
+    cache = S3BlobCache(str(tmp_path / "cache"), max_size=500)
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def reopen():
+    """Close a cache and open its directory again, like a restart.
+
+    Only one cache may use a directory at a time.  Unless scan is false
+    the snapshot is dropped, as after a crash, so the new cache walks the
+    directory.  Reopened caches are closed after the test.
+    """
+    opened = []
+
+    def reopen(cache, scan=True, **kwargs):
+        if not cache._closed:
+            cache.close()
+        if scan:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(cache.cache_dir, "index.bin"))
+        reopened = S3BlobCache(cache.cache_dir, **kwargs)
+        opened.append(reopened)
+        return reopened
+
+    yield reopen
+    for cache in opened:
+        cache.close()
 
 
 def _write_blob(tmp_path, name, size=100):
-    """Create a temp file with given size."""
-    p = tmp_path / name
-    p.write_bytes(b"x" * size)
-    return str(p)
+    """Create a sparse temp file with given size.
+
+    The cache only looks at file sizes, so no data needs to be written.
+    """
+    p = str(tmp_path / name)
+    fd = os.open(p, os.O_CREAT | os.O_WRONLY, 0o600)
+    try:
+        os.ftruncate(fd, size)
+    finally:
+        os.close(fd)
+    return p
 
 
 class TestInterface:
@@ -98,6 +137,239 @@ class TestGetPut:
         assert r2 is not None
         assert r1 != r2
 
+    def test_put_consumes_source(self, cache, tmp_path):
+        blob_path = _write_blob(tmp_path, "consumed.bin", size=42)
+        result = cache.put(_make_oid(1), _make_tid(1), blob_path)
+
+        assert not os.path.exists(blob_path)
+        assert os.path.getsize(result) == 42
+
+    def test_put_copies_across_filesystems(self, cache, tmp_path, cross_device):
+        blob_path = _write_blob(tmp_path, "xdev.bin", size=42)
+
+        result = cache.put(_make_oid(1), _make_tid(1), blob_path)
+
+        assert cache.get(_make_oid(1), _make_tid(1)) == result
+        assert not os.path.exists(blob_path)
+        assert os.path.getsize(result) == 42
+
+    def test_put_only_copies_on_cross_device_error(self, cache, tmp_path, monkeypatch):
+        blob_path = _write_blob(tmp_path, "denied.bin", size=42)
+
+        def rename(src, dst):
+            raise PermissionError(errno.EACCES, "Permission denied")
+
+        monkeypatch.setattr(os, "rename", rename)
+
+        with pytest.raises(PermissionError):
+            cache.put(_make_oid(1), _make_tid(1), blob_path)
+        assert os.path.exists(blob_path)
+        assert cache.get(_make_oid(1), _make_tid(1)) is None
+
+    def test_cross_filesystem_copy_runs_in_background(
+        self, cache, tmp_path, monkeypatch, cross_device
+    ):
+        blob_path = _write_blob(tmp_path, "bg.bin", size=42)
+        release = threading.Event()
+        original = zodb_s3blobs.cache.fast_copy
+
+        def fake_copy(src, dst):
+            release.wait(timeout=10)
+            return original(src, dst)
+
+        monkeypatch.setattr(zodb_s3blobs.cache, "fast_copy", fake_copy)
+        result = cache.put(_make_oid(1), _make_tid(1), blob_path)
+
+        # put() returned before the copy finished
+        assert not os.path.exists(result)
+        release.set()
+        assert cache.get(_make_oid(1), _make_tid(1)) == result
+        assert os.path.getsize(result) == 42
+
+    def test_failed_copy_is_not_cached(
+        self, cache, tmp_path, monkeypatch, cross_device
+    ):
+        blob_path = _write_blob(tmp_path, "fail.bin", size=42)
+
+        def fake_copy(src, dst):
+            with open(dst, "wb") as f:
+                f.write(b"partial")
+            raise OSError(errno.ENOSPC, "No space left on device")
+
+        monkeypatch.setattr(zodb_s3blobs.cache, "fast_copy", fake_copy)
+        result = cache.put(_make_oid(1), _make_tid(1), blob_path)
+
+        assert cache.get(_make_oid(1), _make_tid(1)) is None
+        assert not os.path.exists(result)
+        assert os.path.exists(blob_path)
+
+    def test_close_waits_for_pending_copies(self, tmp_path, cross_device):
+        cache = S3BlobCache(str(tmp_path / "cache"))
+        blob_path = _write_blob(tmp_path, "close.bin", size=42)
+
+        result = cache.put(_make_oid(1), _make_tid(1), blob_path)
+        cache.close()
+
+        assert os.path.getsize(result) == 42
+
+    def test_copied_file_gets_fresh_atime(self, cache, tmp_path, cross_device):
+        blob_path = _write_blob(tmp_path, "old.bin", size=42)
+        os.utime(blob_path, (0, 0))
+
+        cache.put(_make_oid(1), _make_tid(1), blob_path)
+        result = cache.get(_make_oid(1), _make_tid(1))
+
+        assert os.stat(result).st_atime > 0
+
+    def test_path_uses_hex_without_leading_zeros(self, cache, tmp_path):
+        blob_path = _write_blob(tmp_path, "hex.bin")
+        result = cache.put(_make_oid(0x3E7), _make_tid(0x10), blob_path)
+
+        assert result == os.path.join(cache.cache_dir, "e7", "3e7_10.blob")
+
+    def test_oids_share_shard_by_last_two_hex_digits(self, cache, tmp_path):
+        first = cache.put(_make_oid(0x134), _make_tid(1), _write_blob(tmp_path, "a"))
+        second = cache.put(_make_oid(0x234), _make_tid(1), _write_blob(tmp_path, "b"))
+
+        assert os.path.dirname(first) == os.path.dirname(second)
+        assert os.listdir(cache.cache_dir) == ["34"]
+
+    def test_shard_is_zero_padded(self, cache, tmp_path):
+        for i in range(0x20):
+            cache.put(_make_oid(i), _make_tid(1), _write_blob(tmp_path, str(i)))
+
+        assert sorted(os.listdir(cache.cache_dir)) == [f"{i:02x}" for i in range(0x20)]
+
+    def test_path_with_trailing_slash_in_cache_dir(self, tmp_path):
+        cache_dir = str(tmp_path / "cache")
+        cache = S3BlobCache(cache_dir + os.sep)
+        result = cache.put(_make_oid(1), _make_tid(2), _write_blob(tmp_path, "s.bin"))
+
+        assert result == os.path.join(cache_dir, "01", "1_2.blob")
+
+    def test_put_skips_mkdir_for_known_dir(self, cache, tmp_path, monkeypatch):
+        oid = _make_oid(1)
+        cache.put(oid, _make_tid(1), _write_blob(tmp_path, "k1.bin"))
+        calls = []
+        original = os.mkdir
+        monkeypatch.setattr(
+            os, "mkdir", lambda *a, **kw: calls.append(a) or original(*a, **kw)
+        )
+
+        cache.put(oid, _make_tid(2), _write_blob(tmp_path, "k2.bin"))
+        assert calls == []
+
+    def test_put_recreates_dir_removed_behind_its_back(self, cache, tmp_path):
+        oid = _make_oid(1)
+        path = cache.put(oid, _make_tid(1), _write_blob(tmp_path, "r1.bin"))
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+
+        result = cache.put(oid, _make_tid(2), _write_blob(tmp_path, "r2.bin"))
+        assert os.path.exists(result)
+        mode = stat.S_IMODE(os.stat(os.path.dirname(result)).st_mode)
+        assert mode == 0o700
+
+    def test_put_missing_source_raises(self, cache, tmp_path):
+        with pytest.raises(FileNotFoundError):
+            cache.put(_make_oid(1), _make_tid(1), str(tmp_path / "missing.bin"))
+
+    def test_cleanup_keeps_empty_shard_dirs(self, cache, tmp_path):
+        oid = _make_oid(1)
+        path = cache.put(oid, _make_tid(1), _write_blob(tmp_path, "c1.bin"))
+        cache.max_size = 50
+        cache._target_size = 45
+
+        cache._cleanup()
+
+        assert not os.path.exists(path)
+        assert os.path.isdir(os.path.dirname(path))
+        assert os.path.dirname(path) in cache._known_dirs
+
+
+class TestOidLock:
+    def test_same_oid_same_lock(self, cache):
+        assert cache.oid_lock(_make_oid(1)) is cache.oid_lock(_make_oid(1))
+
+    def test_locks_are_striped(self, cache):
+        locks = {id(cache.oid_lock(_make_oid(i))) for i in range(1000)}
+        assert 1 < len(locks) <= 64
+
+
+class TestReserveCommit:
+    def test_reserved_file_is_inside_oid_dir(self, cache):
+        tmp = cache.reserve_path(_make_oid(1), _make_tid(1))
+
+        assert os.path.dirname(tmp) == os.path.join(cache.cache_dir, "01")
+        assert os.path.getsize(tmp) == 0
+
+    def test_reserved_file_is_not_a_cached_blob(self, cache):
+        cache.reserve_path(_make_oid(1), _make_tid(1))
+
+        assert cache.get(_make_oid(1), _make_tid(1)) is None
+        assert cache.current_size() == 0
+
+    def test_commit_renames_into_place(self, cache):
+        oid, tid = _make_oid(1), _make_tid(2)
+        tmp = cache.reserve_path(oid, tid)
+        with open(tmp, "wb") as f:
+            f.write(b"x" * 42)
+
+        result = cache.commit(oid, tid, tmp)
+
+        assert result == os.path.join(cache.cache_dir, "01", "1_2.blob")
+        assert not os.path.exists(tmp)
+        assert cache.get(oid, tid) == result
+        assert cache._total_size == 42
+
+    def test_shard_dir_removed_during_creation(self, cache, tmp_path, monkeypatch):
+        original = os.mkdir
+        calls = []
+
+        def mkdir(path, mode=0o777):
+            calls.append(path)
+            if len(calls) == 1:
+                # The dir existed at mkdir, then a cleanup removed it
+                raise FileExistsError(errno.EEXIST, "File exists", path)
+            original(path, mode)
+
+        monkeypatch.setattr(os, "mkdir", mkdir)
+        result = cache.put(_make_oid(1), _make_tid(1), _write_blob(tmp_path, "d"))
+
+        assert len(calls) == 2
+        assert os.path.isfile(result)
+
+    def test_size_is_taken_before_the_rename(self, cache, tmp_path, monkeypatch):
+        original = os.path.getsize
+
+        def getsize(path):
+            # The shared blob path may be removed by a concurrent cleanup
+            assert not str(path).endswith(".blob")
+            return original(path)
+
+        monkeypatch.setattr(os.path, "getsize", getsize)
+        tmp = cache.reserve_path(_make_oid(1), _make_tid(1))
+        with open(tmp, "wb") as f:
+            f.write(b"x" * 42)
+        cache.commit(_make_oid(1), _make_tid(1), tmp)
+        cache.put(_make_oid(2), _make_tid(1), _write_blob(tmp_path, "p.bin", 10))
+
+        assert cache.current_size() == 52
+
+    def test_recreates_shard_dir_removed_from_outside(self, cache, tmp_path):
+        oid = _make_oid(1)
+        tmp = cache.reserve_path(oid, _make_tid(1))
+        # An outside cleaner removed the empty dir the cache knows about
+        os.remove(tmp)
+        os.rmdir(os.path.dirname(tmp))
+
+        tmp = cache.reserve_path(oid, _make_tid(1))
+        os.remove(tmp)
+        os.rmdir(os.path.dirname(tmp))
+        result = cache.put(oid, _make_tid(2), _write_blob(tmp_path, "r.bin", 42))
+
+        assert os.path.getsize(result) == 42
+
 
 class TestEviction:
     def test_cleanup_removes_oldest_files(self, small_cache, tmp_path):
@@ -107,8 +379,6 @@ class TestEviction:
         for i in range(3):
             blob = _write_blob(tmp_path, f"evict{i}.bin", size=200)
             small_cache.put(oid, _make_tid(i + 1), blob)
-            # Touch files with increasing atime so eviction order is clear
-            time.sleep(0.05)
 
         # Wait for any background cleanup
         small_cache.wait_for_cleanup()
@@ -117,6 +387,66 @@ class TestEviction:
         total = small_cache.current_size()
         assert total <= small_cache.max_size
 
+    def test_startup_order_follows_atime(self, cache, tmp_path, reopen):
+        oid = _make_oid(1)
+        paths = []
+        for i in range(3):
+            blob = _write_blob(tmp_path, f"order{i}.bin", size=200)
+            paths.append(cache.put(oid, _make_tid(i + 1), blob))
+        # paths[1] is the least recently used, paths[0] the most recent
+        for atime, p in zip((3000, 1000, 2000), paths, strict=True):
+            os.utime(p, (atime, atime))
+
+        reopened = reopen(cache, max_size=500)
+        reopened._cleanup()
+
+        assert os.path.exists(paths[0])
+        assert not os.path.exists(paths[1])
+        assert os.path.exists(paths[2])
+
+    def test_get_marks_entry_most_recent(self, cache, tmp_path):
+        oid = _make_oid(1)
+        for i in range(3):
+            blob = _write_blob(tmp_path, f"lru{i}.bin", size=200)
+            cache.put(oid, _make_tid(i + 1), blob)
+        # Hit the oldest entry so it moves to the end
+        assert cache.get(oid, _make_tid(1)) is not None
+        cache.max_size = 500
+        cache._target_size = 450
+
+        cache._cleanup()
+
+        assert cache.get(oid, _make_tid(1)) is not None
+        assert cache.get(oid, _make_tid(2)) is None
+        assert cache.get(oid, _make_tid(3)) is not None
+        assert cache._total_size == 400
+
+    def test_get_does_not_touch_file(self, cache, tmp_path):
+        oid, tid = _make_oid(1), _make_tid(1)
+        path = cache.put(oid, tid, _write_blob(tmp_path, "touch.bin"))
+        os.utime(path, (1000, 1000))
+
+        assert cache.get(oid, tid) == path
+        assert os.stat(path).st_atime == 1000
+
+    def test_eviction_ignores_atime_after_startup(self, cache, tmp_path):
+        oid = _make_oid(1)
+        paths = []
+        for i in range(3):
+            blob = _write_blob(tmp_path, f"noatime{i}.bin", size=200)
+            paths.append(cache.put(oid, _make_tid(i + 1), blob))
+        # As on a noatime mount: on-disk atimes disagree with usage order
+        for atime, p in zip((3000, 2000, 1000), paths, strict=True):
+            os.utime(p, (atime, atime))
+        cache.max_size = 500
+        cache._target_size = 450
+
+        cache._cleanup()
+
+        assert not os.path.exists(paths[0])
+        assert os.path.exists(paths[1])
+        assert os.path.exists(paths[2])
+
     def test_cleanup_reaches_target_size(self, tmp_path):
         """After cleanup, size should be under target (90% of max_size)."""
         cache = S3BlobCache(str(tmp_path / "cache"), max_size=1000)
@@ -125,7 +455,6 @@ class TestEviction:
         for i in range(10):
             blob = _write_blob(tmp_path, f"target{i}.bin", size=200)
             cache.put(oid, _make_tid(i + 1), blob)
-            time.sleep(0.02)
 
         cache.wait_for_cleanup()
         total = cache.current_size()
@@ -149,6 +478,385 @@ class TestEviction:
         total = cache.current_size()
         assert total <= cache.max_size
 
+    def test_fill_overlapping_eviction_keeps_new_file(self, cache, tmp_path):
+        oid, tid = _make_oid(1), _make_tid(1)
+        cache.put(oid, tid, _write_blob(tmp_path, "old.bin", size=100))
+        cache._target_size = 0
+        with cache._lock:
+            victims = cache._evict()
+        # The blob is loaded again before the evicted file is removed
+        tmp = cache.reserve_path(oid, tid)
+        with open(tmp, "wb") as f:
+            f.write(b"x" * 42)
+        path = cache.commit(oid, tid, tmp)
+
+        cache._remove_files(victims)
+
+        assert cache.get(oid, tid) == path
+        assert os.path.getsize(path) == 42
+        assert cache.current_size() == 42
+
+    def test_evicted_file_leaves_no_tombstone(self, cache, tmp_path):
+        path = cache.put(_make_oid(1), _make_tid(1), _write_blob(tmp_path, "a"))
+        cache._target_size = 0
+        with cache._lock:
+            victims = cache._evict()
+
+        cache._remove_files(victims)
+
+        assert os.listdir(os.path.dirname(path)) == []
+
+
+class TestCleanupWorker:
+    def test_put_over_max_wakes_worker(self, small_cache, tmp_path):
+        worker = small_cache._worker
+        for i in range(3):
+            blob = _write_blob(tmp_path, f"wake{i}.bin", size=200)
+            small_cache.put(_make_oid(1), _make_tid(i + 1), blob)
+
+        small_cache.wait_for_cleanup()
+
+        assert small_cache.current_size() <= small_cache._target_size
+        assert small_cache._worker is worker
+        assert small_cache._idle.is_set()
+
+    def test_put_under_max_does_not_wake_worker(self, cache, tmp_path):
+        cache.put(_make_oid(1), _make_tid(1), _write_blob(tmp_path, "a.bin", 100))
+
+        assert not cache._wake.is_set()
+        assert cache._idle.is_set()
+
+    def test_startup_over_max_triggers_cleanup(self, cache, tmp_path, reopen):
+        for i in range(3):
+            blob = _write_blob(tmp_path, f"start{i}.bin", size=200)
+            cache.put(_make_oid(1), _make_tid(i + 1), blob)
+
+        reopened = reopen(cache, max_size=500)
+        reopened.wait_for_cleanup()
+
+        assert reopened.current_size() <= 450
+
+
+class TestCurrentSize:
+    def test_ignores_non_blob_files(self, cache, tmp_path, reopen):
+        blob = _write_blob(tmp_path, "size.bin", size=100)
+        cache.put(_make_oid(1), _make_tid(1), blob)
+        stray = os.path.join(cache.cache_dir, "01", "partial.blob.tmp")
+        with open(stray, "wb") as f:
+            f.write(b"x" * 50)
+
+        assert reopen(cache).current_size() == 100
+
+    def test_does_not_follow_symlinked_dirs(self, cache, tmp_path, reopen):
+        outside = tmp_path / "outside"
+        outside.mkdir()
+        (outside / "1.blob").write_bytes(b"x" * 100)
+        os.symlink(str(outside), os.path.join(cache.cache_dir, "linked"))
+
+        assert reopen(cache).current_size() == 0
+
+    def test_skips_directory_removed_during_walk(
+        self, cache, tmp_path, monkeypatch, reopen
+    ):
+        cache.put(_make_oid(1), _make_tid(1), _write_blob(tmp_path, "a.bin", 100))
+        cache.put(_make_oid(2), _make_tid(1), _write_blob(tmp_path, "b.bin", 50))
+        gone = os.path.join(cache.cache_dir, "02")
+        original = os.scandir
+
+        def scandir(path):
+            if path == gone:
+                raise FileNotFoundError(path)
+            return original(path)
+
+        monkeypatch.setattr(os, "scandir", scandir)
+
+        assert reopen(cache).current_size() == 100
+
+    def test_returns_counter_without_walking(self, cache, tmp_path):
+        cache.put(_make_oid(1), _make_tid(1), _write_blob(tmp_path, "a.bin", 100))
+        cache._iter_blobs = None  # must not be used
+
+        assert cache.current_size() == 100
+
+
+class TestDedup:
+    def _blob(self, tmp_path, name, content):
+        p = tmp_path / name
+        p.write_bytes(content)
+        return str(p)
+
+    def test_identical_blobs_share_inode(self, tmp_path):
+        cache = S3BlobCache(str(tmp_path / "cache"), dedup=True)
+        content = os.urandom(8192)
+        first = cache.put(
+            _make_oid(1), _make_tid(1), self._blob(tmp_path, "a", content)
+        )
+        second = cache.put(
+            _make_oid(2), _make_tid(1), self._blob(tmp_path, "b", content)
+        )
+
+        assert os.path.samefile(first, second)
+        with open(second, "rb") as f:
+            assert f.read() == content
+
+    def test_different_blobs_are_not_linked(self, tmp_path):
+        cache = S3BlobCache(str(tmp_path / "cache"), dedup=True)
+        first = cache.put(_make_oid(1), _make_tid(1), _write_blob(tmp_path, "a", 8192))
+        other = self._blob(tmp_path, "b", b"y" * 8192)
+        second = cache.put(_make_oid(2), _make_tid(1), other)
+
+        assert not os.path.samefile(first, second)
+
+    def test_disabled_by_default(self, cache, tmp_path):
+        content = os.urandom(8192)
+        first = cache.put(
+            _make_oid(1), _make_tid(1), self._blob(tmp_path, "a", content)
+        )
+        second = cache.put(
+            _make_oid(2), _make_tid(1), self._blob(tmp_path, "b", content)
+        )
+
+        assert not os.path.samefile(first, second)
+
+    def test_small_blobs_are_not_hashed(self, tmp_path):
+        cache = S3BlobCache(str(tmp_path / "cache"), dedup=True)
+        cache.put(_make_oid(1), _make_tid(1), self._blob(tmp_path, "a", b"small"))
+
+        assert cache._by_digest == {}
+
+    def test_evicted_original_is_forgotten(self, tmp_path):
+        cache = S3BlobCache(str(tmp_path / "cache"), max_size=10**6, dedup=True)
+        content = os.urandom(8192)
+        first = cache.put(
+            _make_oid(1), _make_tid(1), self._blob(tmp_path, "a", content)
+        )
+        cache.max_size = 1
+        cache._target_size = 0
+        cache._cleanup()
+        cache.max_size = 10**6
+        cache._target_size = 9 * 10**5
+
+        second = cache.put(
+            _make_oid(2), _make_tid(1), self._blob(tmp_path, "b", content)
+        )
+
+        assert not os.path.exists(first)
+        assert list(cache._by_digest.values()) == [second]
+
+
+class TestLegacyLayout:
+    def _write_legacy(self, cache_dir, oid_hex, tid_hex, size=100):
+        os.makedirs(os.path.join(cache_dir, oid_hex), exist_ok=True)
+        path = os.path.join(cache_dir, oid_hex, f"{tid_hex}.blob")
+        with open(path, "wb") as f:
+            f.write(b"x" * size)
+        return path
+
+    def test_startup_moves_legacy_files_into_shards(self, tmp_path):
+        cache_dir = str(tmp_path / "cache")
+        legacy = self._write_legacy(cache_dir, "3e7", "10")
+
+        cache = S3BlobCache(cache_dir)
+
+        expected = os.path.join(cache_dir, "e7", "3e7_10.blob")
+        assert cache.get(_make_oid(0x3E7), _make_tid(0x10)) == expected
+        assert not os.path.exists(legacy)
+        assert not os.path.exists(os.path.dirname(legacy))
+        assert cache.current_size() == 100
+
+    def test_older_legacy_copy_does_not_replace_migrated_file(self, tmp_path):
+        cache_dir = str(tmp_path / "cache")
+        legacy = self._write_legacy(cache_dir, "3e7", "10")
+        os.utime(legacy, (0, 0))
+        current = os.path.join(cache_dir, "e7", "3e7_10.blob")
+        os.makedirs(os.path.dirname(current))
+        with open(current, "wb") as f:
+            f.write(b"y" * 100)
+
+        cache = S3BlobCache(cache_dir)
+
+        assert cache.get(_make_oid(0x3E7), _make_tid(0x10)) == current
+        assert not os.path.exists(legacy)
+        assert cache.current_size() == 100
+        with open(current, "rb") as f:
+            assert f.read() == b"y" * 100
+
+    def test_key_from_path_understands_both_layouts(self):
+        key = (_make_oid(0x3E7), _make_tid(0x10))
+        assert S3BlobCache._key_from_path("/c/e7/3e7_10.blob") == key
+        assert S3BlobCache._key_from_path("/c/3e7/10.blob") == key
+        assert S3BlobCache._key_from_path("/c/e7/zz_10.blob") is None
+
+
+class TestStartupCleanup:
+    def test_removes_stale_tmp_files(self, cache, reopen):
+        stale = cache.reserve_path(_make_oid(1), _make_tid(1))
+        os.utime(stale, (0, 0))
+
+        reopen(cache)
+
+        assert not os.path.exists(stale)
+
+    def test_removes_stale_s3transfer_partial_files(self, cache, reopen):
+        shard_dir, _path = cache._blob_path(_make_oid(1), _make_tid(1))
+        os.makedirs(shard_dir, exist_ok=True)
+        partial = os.path.join(shard_dir, "tmpX.blob.tmp.aB3dE9f0")
+        with open(partial, "wb") as f:
+            f.write(b"partial")
+        an_hour_ago = time.time() - 3600
+        os.utime(partial, (an_hour_ago, an_hour_ago))
+
+        reopen(cache)
+
+        assert not os.path.exists(partial)
+
+    def test_keeps_recent_tmp_files(self, cache, reopen):
+        recent = cache.reserve_path(_make_oid(1), _make_tid(1))
+
+        reopen(cache)
+
+        assert os.path.exists(recent)
+
+
+class TestIndexSnapshot:
+    def _filled_cache(self, tmp_path):
+        cache = S3BlobCache(str(tmp_path / "cache"), max_size=1024 * 1024)
+        for i in range(1, 4):
+            blob = _write_blob(tmp_path, f"{i}.bin", 10 * i)
+            cache.put(_make_oid(i), _make_tid(1), blob)
+        cache.get(_make_oid(1), _make_tid(1))  # most recently used
+        return cache
+
+    def _age_dirs(self, cache_dir):
+        """Backdate the shard dirs, as if written well before close()."""
+        for entry in os.scandir(cache_dir):
+            if entry.is_dir():
+                os.utime(entry.path, ns=(0, 0))
+
+    def test_close_writes_snapshot(self, cache):
+        cache.close()
+        assert os.path.exists(os.path.join(cache.cache_dir, "index.bin"))
+
+    def test_close_skips_snapshot_while_cleanup_runs(self, tmp_path, monkeypatch):
+        cache = self._filled_cache(tmp_path)
+        started = threading.Event()
+        release = threading.Event()
+
+        def cleanup():
+            started.set()
+            release.wait(timeout=10)
+
+        monkeypatch.setattr(cache, "_cleanup", cleanup)
+        with cache._lock:
+            cache._request_cleanup()
+        assert started.wait(timeout=10)
+        # As if the join in close() timed out
+        monkeypatch.setattr(cache._worker, "join", lambda timeout=None: None)
+
+        cache.close()
+
+        release.set()
+        assert not os.path.exists(os.path.join(cache.cache_dir, "index.bin"))
+
+    def test_reopen_loads_snapshot_without_scanning(
+        self, tmp_path, monkeypatch, reopen
+    ):
+        cache = self._filled_cache(tmp_path)
+        self._age_dirs(cache.cache_dir)
+        cache.close()
+        monkeypatch.setattr(
+            S3BlobCache, "_iter_blobs", lambda self, tmp_files=None: 1 / 0
+        )
+
+        reopened = reopen(cache, scan=False, max_size=1024 * 1024)
+
+        assert list(reopened._lru) == list(cache._lru)
+        assert reopened.current_size() == 60
+        path = reopened.get(_make_oid(2), _make_tid(1))
+        assert path == os.path.join(cache.cache_dir, "02", "2_1.blob")
+        assert not os.path.exists(os.path.join(cache.cache_dir, "index.bin"))
+
+    def test_modified_dir_falls_back_to_scan(self, tmp_path, reopen):
+        cache = self._filled_cache(tmp_path)
+        self._age_dirs(cache.cache_dir)
+        cache.close()
+        # A blob is added after the snapshot was written
+        other = os.path.join(cache.cache_dir, "04", "4_1.blob")
+        os.makedirs(os.path.dirname(other))
+        with open(other, "wb") as f:
+            f.write(b"x" * 40)
+        os.utime(os.path.dirname(other), ns=(2**62, 2**62))
+
+        reopened = reopen(cache, scan=False, max_size=1024 * 1024)
+
+        assert reopened.get(_make_oid(4), _make_tid(1)) == other
+        assert reopened.current_size() == 100
+
+    def test_dir_modified_in_same_tick_falls_back_to_scan(self, tmp_path, reopen):
+        cache = self._filled_cache(tmp_path)
+        self._age_dirs(cache.cache_dir)
+        cache.close()
+        # Coarse timestamps: a blob added right after the snapshot was
+        # written leaves its dir with the snapshot's mtime
+        index = os.path.join(cache.cache_dir, "index.bin")
+        other = os.path.join(cache.cache_dir, "04", "4_1.blob")
+        os.makedirs(os.path.dirname(other))
+        with open(other, "wb") as f:
+            f.write(b"x" * 40)
+        written = os.stat(index).st_mtime_ns
+        os.utime(os.path.dirname(other), ns=(written, written))
+
+        reopened = reopen(cache, scan=False, max_size=1024 * 1024)
+
+        assert reopened.get(_make_oid(4), _make_tid(1)) == other
+        assert reopened.current_size() == 100
+
+    def test_corrupt_snapshot_falls_back_to_scan(self, tmp_path, reopen):
+        cache = self._filled_cache(tmp_path)
+        self._age_dirs(cache.cache_dir)
+        cache.close()
+        index = os.path.join(cache.cache_dir, "index.bin")
+        with open(index, "ab") as f:
+            f.write(b"junk")
+
+        reopened = reopen(cache, scan=False, max_size=1024 * 1024)
+
+        assert reopened.current_size() == 60
+        assert not os.path.exists(index)
+
+
+class TestSizeTracking:
+    def test_initial_size_from_existing_files(self, tmp_path, reopen):
+        cache = S3BlobCache(str(tmp_path / "cache"), max_size=1024 * 1024)
+        cache.put(_make_oid(1), _make_tid(1), _write_blob(tmp_path, "a.bin", 100))
+        cache.put(_make_oid(2), _make_tid(1), _write_blob(tmp_path, "b.bin", 50))
+
+        reopened = reopen(cache, max_size=1024 * 1024)
+        assert reopened._total_size == 150
+
+    def test_put_updates_total(self, cache, tmp_path):
+        cache.put(_make_oid(1), _make_tid(1), _write_blob(tmp_path, "a.bin", 100))
+        assert cache._total_size == 100
+
+    def test_cleanup_never_walks_directory(self, cache, tmp_path):
+        cache.put(_make_oid(1), _make_tid(1), _write_blob(tmp_path, "a.bin", 100))
+        walks = []
+        cache._iter_blobs = lambda: walks.append(True) or iter(())
+        cache.max_size = 50
+        cache._target_size = 45
+
+        cache._cleanup()
+        assert walks == []
+        assert cache._total_size == 0
+
+    def test_put_same_key_replaces_entry(self, cache, tmp_path):
+        oid, tid = _make_oid(1), _make_tid(1)
+        cache.put(oid, tid, _write_blob(tmp_path, "a.bin", 100))
+        cache.put(oid, tid, _write_blob(tmp_path, "b.bin", 30))
+
+        assert cache._total_size == 30
+        assert len(cache._lru) == 1
+
 
 class TestConcurrency:
     def test_concurrent_puts(self, cache, tmp_path):
@@ -203,12 +911,39 @@ class TestTOCTOU:
 
         assert cache.get(oid, tid) is None
 
+    def test_missing_file_drops_entry(self, cache, tmp_path):
+        blob_path = _write_blob(tmp_path, "stale.bin", size=100)
+        oid = _make_oid(1)
+        tid = _make_tid(1)
+        os.remove(cache.put(oid, tid, blob_path))
+
+        assert cache.get(oid, tid) is None
+        assert oid + tid not in cache._lru
+        assert cache._total_size == 0
+
+    def test_dropped_entry_requeued_on_put(self, cache, tmp_path):
+        oid = _make_oid(1)
+        os.remove(cache.put(oid, _make_tid(1), _write_blob(tmp_path, "a.bin", 100)))
+        cache.get(oid, _make_tid(1))
+        # Same key cached again gets a fresh entry
+        cache.put(oid, _make_tid(1), _write_blob(tmp_path, "b.bin", 100))
+        cache.put(oid, _make_tid(2), _write_blob(tmp_path, "c.bin", 100))
+        cache.max_size = 150
+        cache._target_size = 100
+
+        cache._cleanup()
+
+        assert cache.get(oid, _make_tid(1)) is None
+        assert cache.get(oid, _make_tid(2)) is not None
+        assert cache._total_size == 100
+
 
 class TestCacheClose:
     def test_close_joins_thread(self, cache, tmp_path):
         """close() should join the cleanup thread."""
-        cache.notify_loaded(cache._check_threshold + 1)
+        cache.notify_loaded(0)
         cache.close()
+        assert not cache._worker.is_alive()
 
     def test_close_idempotent(self, cache):
         """Calling close() multiple times should not raise."""
@@ -1,20 +1,10 @@
-from moto import mock_aws
 from zodb_s3blobs.storage import S3BlobStorage
 
 import base64
-import boto3
 import os
-import pytest
 import ZODB.config
 
 
-@pytest.fixture
-def s3_env():
-    with mock_aws():
-        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="test-bucket")
-        yield
-
-
 class TestZConfig:
     def test_creates_storage(self, s3_env, tmp_path):
         cache_dir = str(tmp_path / "cache")
@@ -49,6 +39,8 @@ class TestZConfig:
                 s3-addressing-style path
                 cache-dir {cache_dir}
                 cache-size 512MB
+                cache-dedup true
+                upload-concurrency 3
                 <mappingstorage>
                 </mappingstorage>
             </s3blobstorage>
@@ -58,6 +50,8 @@ class TestZConfig:
         assert storage._s3_client._prefix == "myprefix"
         assert storage._s3_client.bucket_name == "test-bucket"
         assert storage._cache.max_size == 512 * 1024 * 1024
+        assert storage._cache._dedup is True
+        assert storage._upload_pool._max_workers == 3
         storage.close()
 
     def test_default_values(self, s3_env, tmp_path):
@@ -77,6 +71,8 @@ class TestZConfig:
         assert isinstance(storage, S3BlobStorage)
         # Default cache size is 1GB
         assert storage._cache.max_size == 1024 * 1024 * 1024
+        assert storage._cache._dedup is False
+        assert storage._upload_pool._max_workers == 8
         # Default prefix is empty
         assert storage._s3_client._prefix == ""
         storage.close()
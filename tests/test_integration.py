@@ -1,26 +1,17 @@
 """End-to-end integration tests using ZODB + moto S3."""
 
-from moto import mock_aws
 from ZODB.MappingStorage import MappingStorage
 from ZODB.utils import p64
 from zodb_s3blobs.cache import S3BlobCache
 from zodb_s3blobs.s3client import S3Client
 from zodb_s3blobs.storage import S3BlobStorage
 
-import boto3
 import os
 import pytest
 import transaction
 import ZODB
 
 
-@pytest.fixture
-def s3_env():
-    with mock_aws():
-        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="test-bucket")
-        yield
-
-
 @pytest.fixture
 def s3_client(s3_env):
     return S3Client(bucket_name="test-bucket", region_name="us-east-1")
@@ -1,4 +1,3 @@
-from moto import mock_aws
 from zodb_s3blobs.interfaces import IS3Client
 from zodb_s3blobs.s3client import S3Client
 
@@ -9,13 +8,6 @@ import pytest
 import stat
 
 
-@pytest.fixture
-def s3_env():
-    with mock_aws():
-        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="test-bucket")
-        yield
-
-
 @pytest.fixture
 def client(s3_env):
     return S3Client(bucket_name="test-bucket", region_name="us-east-1")
@@ -69,6 +61,13 @@ class TestUploadDownload:
         client.download_file("large/key.blob", str(dst))
         assert dst.read_bytes() == data
 
+    def test_download_missing_key_raises_not_found(self, client, tmp_path):
+        from zodb_s3blobs.s3client import S3NotFoundError
+
+        with pytest.raises(S3NotFoundError, match=r"missing/key\.blob"):
+            client.download_file("missing/key.blob", str(tmp_path / "dl.bin"))
+        assert list(tmp_path.iterdir()) == []
+
 
 class TestDeleteObject:
     def test_delete_object(self, client, tmp_path):
@@ -84,6 +83,89 @@ class TestDeleteObject:
         """Deleting a non-existent key should not raise."""
         client.delete_object("nonexistent/key.blob")
 
+    def test_delete_object_uses_batch_api(self, client, monkeypatch):
+        calls = []
+        monkeypatch.setattr(
+            client._client,
+            "delete_objects",
+            lambda **kwargs: calls.append(kwargs["Delete"]["Objects"]) or {},
+        )
+
+        client.delete_object("one/key.blob")
+
+        assert calls == [[{"Key": "one/key.blob"}]]
+
+
+class TestDeleteObjects:
+    def test_delete_objects(self, client, tmp_path):
+        src = tmp_path / "batch.bin"
+        src.write_bytes(b"delete me")
+        for i in range(5):
+            client.upload_file(str(src), f"batch/{i}.blob")
+
+        client.delete_objects(f"batch/{i}.blob" for i in range(4))
+
+        assert list(client.list_objects("batch/")) == ["batch/4.blob"]
+
+    def test_delete_objects_batches_requests(self, client, tmp_path, monkeypatch):
+        import zodb_s3blobs.s3client
+
+        src = tmp_path / "batch.bin"
+        src.write_bytes(b"delete me")
+        keys = [f"batch/{i}.blob" for i in range(5)]
+        for key in keys:
+            client.upload_file(str(src), key)
+        monkeypatch.setattr(zodb_s3blobs.s3client, "_DELETE_BATCH_SIZE", 2)
+        calls = []
+        original = client._client.delete_objects
+
+        def delete_objects(**kwargs):
+            calls.append(len(kwargs["Delete"]["Objects"]))
+            return original(**kwargs)
+
+        monkeypatch.setattr(client._client, "delete_objects", delete_objects)
+        client.delete_objects(keys)
+
+        assert calls == [2, 2, 1]
+        assert list(client.list_objects("batch/")) == []
+
+    def test_delete_objects_with_prefix(self, prefixed_client, tmp_path):
+        src = tmp_path / "batch.bin"
+        src.write_bytes(b"delete me")
+        prefixed_client.upload_file(str(src), "batch/a.blob")
+
+        prefixed_client.delete_objects(["batch/a.blob"])
+        assert prefixed_client.head_object("batch/a.blob") is None
+
+    def test_delete_objects_nonexistent_does_not_raise(self, client):
+        client.delete_objects(["nonexistent/a.blob", "nonexistent/b.blob"])
+
+    def test_delete_objects_empty(self, client):
+        client.delete_objects([])
+
+    def test_delete_objects_reports_errors(self, client, monkeypatch):
+        from zodb_s3blobs.s3client import S3OperationError
+
+        monkeypatch.setattr(
+            client._client,
+            "delete_objects",
+            lambda **kwargs: {
+                "Errors": [{"Key": "a.blob", "Code": "AccessDenied"}],
+            },
+        )
+        with pytest.raises(S3OperationError, match=r"1 key.*AccessDenied"):
+            client.delete_objects(["a.blob"])
+
+    def test_delete_objects_ignores_missing_keys(self, client, monkeypatch):
+        monkeypatch.setattr(
+            client._client,
+            "delete_objects",
+            lambda **kwargs: {
+                "Errors": [{"Key": "a.blob", "Code": "NoSuchKey"}],
+            },
+        )
+        client.delete_objects(["a.blob"])
+
 
 class TestHeadObject:
     def test_head_object_exists(self, client, tmp_path):
@@ -116,6 +198,20 @@ class TestListObjects:
         keys = list(client.list_objects("nonexistent/"))
         assert keys == []
 
+    def test_list_objects_fetches_pages_lazily(self, client, monkeypatch):
+        fetched = []
+
+        class Paginator:
+            def paginate(self, **kwargs):
+                for page in range(3):
+                    fetched.append(page)
+                    yield {"Contents": [{"Key": f"lazy/{page}.blob"}]}
+
+        monkeypatch.setattr(client._client, "get_paginator", lambda name: Paginator())
+
+        assert next(iter(client.list_objects("lazy/"))) == "lazy/0.blob"
+        assert fetched == [0]
+
 
 class TestPrefix:
     def test_prefix_applied_to_upload(self, prefixed_client, tmp_path):
@@ -152,6 +248,34 @@ class TestPrefix:
         assert client_a.head_object("key.blob") is not None
         assert client_b.head_object("key.blob") is None
 
+    def test_list_all_excludes_longer_prefix(self, s3_env, tmp_path):
+        """Listing prefix "ns" must not return keys stored under "ns2"."""
+        client = S3Client(
+            bucket_name="test-bucket", prefix="ns", region_name="us-east-1"
+        )
+        other = S3Client(
+            bucket_name="test-bucket", prefix="ns2", region_name="us-east-1"
+        )
+        src = tmp_path / "iso.bin"
+        src.write_bytes(b"isolation test")
+        client.upload_file(str(src), "a.blob")
+        other.upload_file(str(src), "b.blob")
+
+        assert list(client.list_objects()) == ["a.blob"]
+        assert list(other.list_objects()) == ["b.blob"]
+
+    def test_trailing_slash_in_prefix_is_not_doubled(self, s3_env, tmp_path):
+        client = S3Client(
+            bucket_name="test-bucket", prefix="ns/", region_name="us-east-1"
+        )
+        src = tmp_path / "slash.bin"
+        src.write_bytes(b"slash")
+        client.upload_file(str(src), "key.blob")
+
+        s3 = boto3.client("s3", region_name="us-east-1")
+        resp = s3.list_objects_v2(Bucket="test-bucket")
+        assert [obj["Key"] for obj in resp["Contents"]] == ["ns/key.blob"]
+
     def test_no_prefix(self, client, tmp_path):
         """Client with no prefix stores keys as-is."""
         src = tmp_path / "no_prefix.bin"
@@ -287,6 +411,108 @@ class TestDownloadDirPermissions:
         assert mode == 0o700
 
 
+class TestClientConfig:
+    def test_connection_pool_and_retries(self, client):
+        config = client._client.meta.config
+        assert config.max_pool_connections == 50
+        assert config.tcp_keepalive is True
+        assert config.retries["mode"] == "adaptive"
+
+    def test_max_pool_connections_configurable(self, s3_env):
+        client = S3Client(
+            bucket_name="test-bucket",
+            region_name="us-east-1",
+            max_pool_connections=20,
+        )
+        assert client._client.meta.config.max_pool_connections == 20
+
+    def test_pool_covers_transfer_concurrency(self, s3_env):
+        client = S3Client(
+            bucket_name="test-bucket",
+            region_name="us-east-1",
+            max_pool_connections=2,
+        )
+        assert client._client.meta.config.max_pool_connections == 10
+
+
+class TestTransferManager:
+    def test_transfers_reuse_one_manager(self, client, tmp_path, monkeypatch):
+        def fail(*args, **kwargs):
+            raise AssertionError("per-call transfer manager used")
+
+        monkeypatch.setattr(client._client, "upload_file", fail)
+        monkeypatch.setattr(client._client, "download_file", fail)
+        manager = client._transfer
+        src = tmp_path / "src.bin"
+        src.write_bytes(b"shared")
+
+        client.upload_file(str(src), "shared/key.blob")
+        client.download_file("shared/key.blob", str(tmp_path / "dst.bin"))
+
+        assert client._transfer is manager
+        assert (tmp_path / "dst.bin").read_bytes() == b"shared"
+
+    def test_multipart_threshold(self, s3_env, tmp_path):
+        src = tmp_path / "big.bin"
+        with open(src, "wb") as f:
+            f.truncate(6 * 1024 * 1024)
+        single = S3Client(bucket_name="test-bucket", region_name="us-east-1")
+        multi = S3Client(
+            bucket_name="test-bucket",
+            region_name="us-east-1",
+            multipart_threshold=5 * 1024 * 1024,
+            max_concurrency=4,
+        )
+
+        single.upload_file(str(src), "single.blob")
+        multi.upload_file(str(src), "multi.blob")
+
+        # Multipart ETags end in "-<number of parts>"
+        assert "-" not in single.head_object("single.blob")["ETag"]
+        assert multi.head_object("multi.blob")["ETag"].endswith('-1"')
+        assert multi._transfer._config.max_concurrency == 4
+
+    def test_large_download_uses_ranged_gets(self, client, tmp_path):
+        src = tmp_path / "big.bin"
+        with open(src, "wb") as f:
+            f.truncate(17 * 1024 * 1024)
+            f.write(b"head")
+        client.upload_file(str(src), "big.blob")
+        ranges = []
+        client._client.meta.events.register(
+            "provide-client-params.s3.GetObject",
+            lambda params, **kwargs: ranges.append(params.get("Range")),
+        )
+
+        dst = tmp_path / "big_dl.bin"
+        client.download_file("big.blob", str(dst))
+
+        # Three 8 MB parts, fetched as separate range requests
+        assert len(ranges) == 3
+        assert all(r and r.startswith("bytes=") for r in ranges)
+        assert dst.stat().st_size == src.stat().st_size
+        with open(dst, "rb") as f:
+            assert f.read(4) == b"head"
+
+    def test_upload_error_is_wrapped(self, s3_env, tmp_path):
+        from zodb_s3blobs.s3client import S3OperationError
+
+        client = S3Client(bucket_name="no-such-bucket", region_name="us-east-1")
+        src = tmp_path / "src.bin"
+        src.write_bytes(b"data")
+
+        with pytest.raises(S3OperationError, match=r"upload failed"):
+            client.upload_file(str(src), "key.blob")
+
+    def test_close_shuts_down_manager(self, client, monkeypatch):
+        calls = []
+        monkeypatch.setattr(client._transfer, "shutdown", lambda: calls.append(1))
+
+        client.close()
+
+        assert calls == [1]
+
+
 class TestS3OperationError:
     def test_error_type_is_importable(self):
         from zodb_s3blobs.s3client import S3OperationError
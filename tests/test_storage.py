@@ -1,25 +1,20 @@
-from moto import mock_aws
 from ZODB.MappingStorage import MappingStorage
 from ZODB.utils import p64
 from zodb_s3blobs.cache import S3BlobCache
 from zodb_s3blobs.s3client import S3Client
+from zodb_s3blobs.s3client import S3OperationError
 from zodb_s3blobs.storage import S3BlobStorage
 
-import boto3
+import concurrent.futures
+import errno
 import os
 import pytest
 import stat
+import time
 import transaction
 import ZODB.interfaces
 
 
-@pytest.fixture
-def s3_env():
-    with mock_aws():
-        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="test-bucket")
-        yield
-
-
 @pytest.fixture
 def base_storage():
     return MappingStorage()
@@ -80,6 +75,43 @@ class TestStoreBlob:
         # Blob should be staged (original file consumed)
         assert not os.path.exists(blob_path)
 
+    def test_store_blob_renames_on_same_filesystem(self, storage, tmp_path):
+        blob_path = _make_blob_file(tmp_path)
+        inode = os.stat(blob_path).st_ino
+        txn = transaction.get()
+        storage.tpc_begin(txn)
+        storage.storeBlob(p64(1), p64(0), b"pickle", blob_path, "", txn)
+
+        # Same inode: the file was moved, not copied
+        assert os.stat(storage._pending_blobs[p64(1)]).st_ino == inode
+
+    def test_store_blob_copies_across_filesystems(
+        self, storage, tmp_path, cross_device
+    ):
+        blob_path = _make_blob_file(tmp_path, b"cross device")
+
+        txn = transaction.get()
+        storage.tpc_begin(txn)
+        storage.storeBlob(p64(1), p64(0), b"pickle", blob_path, "", txn)
+
+        assert not os.path.exists(blob_path)
+        with open(storage._pending_blobs[p64(1)], "rb") as f:
+            assert f.read() == b"cross device"
+
+    def test_store_blob_rename_error_is_raised(self, storage, tmp_path, monkeypatch):
+        blob_path = _make_blob_file(tmp_path)
+
+        def rename(src, dst):
+            raise PermissionError(errno.EACCES, "Permission denied")
+
+        monkeypatch.setattr(os, "rename", rename)
+        txn = transaction.get()
+        storage.tpc_begin(txn)
+        with pytest.raises(PermissionError):
+            storage.storeBlob(p64(1), p64(0), b"pickle", blob_path, "", txn)
+        assert os.path.exists(blob_path)
+        assert storage._pending_blobs == {}
+
     def test_store_blob_calls_base_store(self, storage, base_storage, tmp_path):
         oid = p64(1)
         blob_path = _make_blob_file(tmp_path)
@@ -126,6 +158,25 @@ class TestTwoPhaseCommit:
         with open(cached, "rb") as f:
             assert f.read() == b"cache after finish"
 
+    def test_tpc_finish_moves_staged_file_into_cache(
+        self, storage, blob_cache, tmp_path
+    ):
+        oid = p64(1)
+        blob_path = _make_blob_file(tmp_path, b"no copy")
+        inode = os.stat(blob_path).st_ino
+        txn = transaction.get()
+        storage.tpc_begin(txn)
+        storage.storeBlob(oid, p64(0), b"pickle", blob_path, "", txn)
+        staged = storage._pending_blobs[oid]
+        storage.tpc_vote(txn)
+        tid = storage.tpc_finish(txn)
+
+        # The caller's file ends up in the cache without a single copy
+        cached = blob_cache.get(oid, tid)
+        assert os.stat(cached).st_ino == inode
+        assert os.stat(cached).st_nlink == 1
+        assert not os.path.exists(staged)
+
     def test_tpc_finish_clears_pending(self, storage, tmp_path):
         oid = p64(1)
         blob_path = _make_blob_file(tmp_path)
@@ -169,6 +220,30 @@ class TestTwoPhaseCommit:
         keys_after = list(s3_client.list_objects("blobs/"))
         assert len(keys_after) == 0
 
+    def test_tpc_abort_deletes_in_one_batch(
+        self, storage, s3_client, tmp_path, monkeypatch
+    ):
+        txn = transaction.get()
+        storage.tpc_begin(txn)
+        for i in range(5):
+            blob_path = _make_blob_file(tmp_path, f"blob {i}".encode())
+            storage.storeBlob(p64(i + 1), p64(0), b"pickle", blob_path, "", txn)
+        storage.tpc_vote(txn)
+        requests = []
+        original = s3_client._client.delete_objects
+
+        def delete_objects(**kwargs):
+            requests.append(len(kwargs["Delete"]["Objects"]))
+            return original(**kwargs)
+
+        monkeypatch.setattr(s3_client._client, "delete_objects", delete_objects)
+        monkeypatch.setattr(s3_client._client, "delete_object", lambda **kwargs: 1 / 0)
+
+        storage.tpc_abort(txn)
+
+        assert requests == [5]
+        assert list(s3_client.list_objects("blobs/")) == []
+
     def test_tpc_abort_cleans_staged_files(self, storage, tmp_path):
         oid = p64(1)
         blob_path = _make_blob_file(tmp_path)
@@ -190,8 +265,8 @@ class TestTwoPhaseCommit:
         storage.tpc_vote(txn)
 
         # Monkey-patch delete to fail
-        original_delete = s3_client.delete_object
-        s3_client.delete_object = lambda key: (_ for _ in ()).throw(
+        original_delete = s3_client.delete_objects
+        s3_client.delete_objects = lambda keys: (_ for _ in ()).throw(
             Exception("S3 down")
         )
 
@@ -200,7 +275,7 @@ class TestTwoPhaseCommit:
         assert storage._pending_blobs == {}
         assert storage._uploaded_keys == []
 
-        s3_client.delete_object = original_delete
+        s3_client.delete_objects = original_delete
 
     def test_multiple_blobs_single_transaction(self, storage, s3_client, tmp_path):
         txn = transaction.get()
@@ -218,6 +293,79 @@ class TestTwoPhaseCommit:
 
         storage.tpc_finish(txn)
 
+    def test_failed_parallel_upload_records_successful_keys(
+        self, storage, s3_client, tmp_path
+    ):
+        txn = transaction.get()
+        storage.tpc_begin(txn)
+        for i in range(3):
+            blob_path = _make_blob_file(tmp_path, f"blob {i}".encode())
+            storage.storeBlob(p64(i + 1), p64(0), b"pickle", blob_path, "", txn)
+
+        original_upload = s3_client.upload_file
+
+        def upload_file(local_path, s3_key):
+            if s3_key.startswith("blobs/2/"):
+                raise Exception("S3 down")
+            original_upload(local_path, s3_key)
+
+        s3_client.upload_file = upload_file
+        with pytest.raises(Exception, match="S3 down"):
+            storage.tpc_vote(txn)
+        uploaded = {key for _oid, _tid, key in storage._uploaded_keys}
+        assert uploaded == set(s3_client.list_objects("blobs/"))
+        assert not any(key.startswith("blobs/2/") for key in uploaded)
+
+        storage.tpc_abort(txn)
+        assert list(s3_client.list_objects("blobs/")) == []
+
+    def test_max_upload_concurrency(
+        self, base_storage, s3_client, blob_cache, tmp_path
+    ):
+        store = S3BlobStorage(
+            base_storage,
+            s3_client,
+            blob_cache,
+            temp_dir=str(tmp_path / "staging"),
+            max_upload_concurrency=2,
+        )
+        running = []
+        peak = []
+        original_upload = s3_client.upload_file
+
+        def upload_file(local_path, s3_key):
+            running.append(s3_key)
+            peak.append(len(running))
+            time.sleep(0.05)
+            original_upload(local_path, s3_key)
+            running.remove(s3_key)
+
+        s3_client.upload_file = upload_file
+        txn = transaction.get()
+        store.tpc_begin(txn)
+        for i in range(5):
+            blob_path = _make_blob_file(tmp_path, f"blob {i}".encode())
+            store.storeBlob(p64(i + 1), p64(0), b"pickle", blob_path, "", txn)
+        store.tpc_vote(txn)
+        store.tpc_finish(txn)
+
+        assert max(peak) == 2
+        assert len(list(s3_client.list_objects("blobs/"))) == 5
+
+    def test_parallel_uploads_reuse_storage_pool(self, storage, tmp_path):
+        pool = storage._upload_pool
+        for round_ in range(2):
+            txn = transaction.get()
+            storage.tpc_begin(txn)
+            for i in range(3):
+                content = f"blob {round_} {i}".encode()
+                blob_path = _make_blob_file(tmp_path, content)
+                oid = p64(round_ * 10 + i + 1)
+                storage.storeBlob(oid, p64(0), b"pickle", blob_path, "", txn)
+            storage.tpc_vote(txn)
+            storage.tpc_finish(txn)
+        assert storage._upload_pool is pool
+
 
 class TestLoadBlob:
     def _store_and_commit(self, storage, oid, blob_content, tmp_path):
@@ -253,12 +401,143 @@ class TestLoadBlob:
         with open(result, "rb") as f:
             assert f.read() == b"s3 blob"
 
+    def test_load_blob_downloads_into_cache_dir(
+        self, storage, blob_cache, tmp_path, monkeypatch
+    ):
+        oid = p64(1)
+        tid = self._store_and_commit(storage, oid, b"direct", tmp_path)
+        os.remove(blob_cache.get(oid, tid))
+        targets = []
+        original = storage._s3_client.download_file
+
+        def download_file(s3_key, local_path):
+            targets.append(local_path)
+            return original(s3_key, local_path)
+
+        monkeypatch.setattr(storage._s3_client, "download_file", download_file)
+        monkeypatch.setattr(blob_cache, "put", None)  # must not be used
+
+        result = storage.loadBlob(oid, tid)
+
+        assert os.path.dirname(targets[0]) == os.path.dirname(result)
+        assert not os.path.exists(targets[0])
+        with open(result, "rb") as f:
+            assert f.read() == b"direct"
+
+    def test_load_blob_failed_download_leaves_no_tmp(
+        self, storage, blob_cache, tmp_path, monkeypatch
+    ):
+        oid = p64(1)
+        tid = self._store_and_commit(storage, oid, b"fail", tmp_path)
+        cached = blob_cache.get(oid, tid)
+        os.remove(cached)
+
+        def download_file(s3_key, local_path):
+            raise S3OperationError("boom")
+
+        monkeypatch.setattr(storage._s3_client, "download_file", download_file)
+
+        with pytest.raises(S3OperationError):
+            storage.loadBlob(oid, tid)
+        assert os.listdir(os.path.dirname(cached)) == []
+
     def test_load_blob_not_found(self, storage):
         from ZODB.POSException import POSKeyError
 
         with pytest.raises(POSKeyError):
             storage.loadBlob(p64(999), p64(999))
 
+    def test_concurrent_misses_download_once(
+        self, storage, blob_cache, tmp_path, monkeypatch
+    ):
+        oid = p64(1)
+        tid = self._store_and_commit(storage, oid, b"once", tmp_path)
+        os.remove(blob_cache.get(oid, tid))
+        calls = []
+        original = storage._s3_client.download_file
+
+        def download_file(s3_key, local_path):
+            calls.append(s3_key)
+            time.sleep(0.05)
+            return original(s3_key, local_path)
+
+        monkeypatch.setattr(storage._s3_client, "download_file", download_file)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda _: storage.loadBlob(oid, tid), range(4)))
+
+        assert len(calls) == 1
+        assert len(set(results)) == 1
+
+    def test_load_blob_miss_skips_head_object(
+        self, storage, blob_cache, tmp_path, monkeypatch
+    ):
+        oid = p64(1)
+        tid = self._store_and_commit(storage, oid, b"no head", tmp_path)
+        os.remove(blob_cache.get(oid, tid))
+        monkeypatch.setattr(storage._s3_client, "head_object", None)
+
+        with open(storage.loadBlob(oid, tid), "rb") as f:
+            assert f.read() == b"no head"
+
+    def test_missing_blob_is_remembered(self, storage, s3_client, monkeypatch):
+        from ZODB.POSException import POSKeyError
+
+        calls = []
+        original = s3_client.download_file
+
+        def download_file(s3_key, local_path):
+            calls.append(s3_key)
+            original(s3_key, local_path)
+
+        monkeypatch.setattr(s3_client, "download_file", download_file)
+        for _ in range(3):
+            with pytest.raises(POSKeyError):
+                storage.loadBlob(p64(999), p64(999))
+        assert calls == ["blobs/3e7/3e7.blob"]
+        # MVCC instances share what was found missing
+        with pytest.raises(POSKeyError):
+            storage.new_instance().loadBlob(p64(999), p64(999))
+        assert len(calls) == 1
+
+    def test_missing_blob_expires(self, storage, s3_client, tmp_path, monkeypatch):
+        from ZODB.POSException import POSKeyError
+
+        import zodb_s3blobs.storage
+
+        monkeypatch.setattr(zodb_s3blobs.storage, "_MISSING_TTL", 0)
+        with pytest.raises(POSKeyError):
+            storage.loadBlob(p64(999), p64(999))
+        s3_client.upload_file(_make_blob_file(tmp_path, b"late"), "blobs/3e7/3e7.blob")
+        with open(storage.loadBlob(p64(999), p64(999)), "rb") as f:
+            assert f.read() == b"late"
+        assert storage._missing == {}
+
+    def test_missing_blobs_are_bounded(self, storage, monkeypatch):
+        import zodb_s3blobs.storage
+
+        monkeypatch.setattr(zodb_s3blobs.storage, "_MISSING_MAX", 2)
+        for tid in range(3):
+            storage._remember_missing(p64(1), p64(tid))
+        assert list(storage._missing) == [(p64(1), p64(1)), (p64(1), p64(2))]
+
+    def test_commit_forgets_missing_blob(self, storage, tmp_path):
+        txn = transaction.get()
+        storage.tpc_begin(txn)
+        storage.storeBlob(p64(1), p64(0), b"pickle", _make_blob_file(tmp_path), "", txn)
+        storage.tpc_vote(txn)
+        storage._remember_missing(p64(1), storage._tid)
+        tid = storage.tpc_finish(txn)
+
+        assert (p64(1), tid) not in storage._missing
+        assert storage.loadBlob(p64(1), tid)
+
+    def test_load_blob_not_found_leaves_no_tmp(self, storage, blob_cache):
+        from ZODB.POSException import POSKeyError
+
+        with pytest.raises(POSKeyError):
+            storage.loadBlob(p64(999), p64(999))
+        assert os.listdir(os.path.join(blob_cache.cache_dir, "e7")) == []
+
     def test_open_committed_blob_file(self, storage, tmp_path):
         oid = p64(1)
         tid = self._store_and_commit(storage, oid, b"open test", tmp_path)
@@ -283,6 +562,71 @@ class TestLoadBlob:
             f.close()
 
 
+class TestPrefetch:
+    def _commit_blobs(self, storage, tmp_path, count):
+        txn = transaction.get()
+        storage.tpc_begin(txn)
+        for i in range(1, count + 1):
+            blob_path = _make_blob_file(tmp_path, f"blob {i}".encode())
+            storage.storeBlob(p64(i), p64(0), b"pickle", blob_path, "", txn)
+        storage.tpc_vote(txn)
+        return storage.tpc_finish(txn)
+
+    def test_prefetch_populates_cache(self, storage, blob_cache, tmp_path):
+        tid = self._commit_blobs(storage, tmp_path, 3)
+        for i in range(1, 4):
+            os.remove(blob_cache.get(p64(i), tid))
+            assert blob_cache.get(p64(i), tid) is None
+
+        futures = storage.prefetch((p64(i), tid) for i in range(1, 4))
+        concurrent.futures.wait(futures)
+
+        for i in range(1, 4):
+            with open(blob_cache.get(p64(i), tid), "rb") as f:
+                assert f.read() == f"blob {i}".encode()
+
+    def test_prefetch_failure_is_logged(self, storage, blob_cache, tmp_path, caplog):
+        tid = self._commit_blobs(storage, tmp_path, 1)
+
+        concurrent.futures.wait(storage.prefetch([(p64(999), tid), (p64(1), tid)]))
+
+        assert "Failed to prefetch blob for oid=3e7" in caplog.text
+        assert blob_cache.get(p64(1), tid) is not None
+
+    def test_prefetch_nothing(self, storage):
+        assert storage.prefetch([]) == []
+
+    def test_prefetch_returns_before_downloads_finish(
+        self, storage, blob_cache, s3_client, tmp_path, monkeypatch
+    ):
+        import threading
+
+        tid = self._commit_blobs(storage, tmp_path, 1)
+        os.remove(blob_cache.get(p64(1), tid))
+        release = threading.Event()
+        downloads = []
+        original = s3_client.download_file
+
+        def download_file(s3_key, local_path):
+            downloads.append(s3_key)
+            assert release.wait(timeout=5)
+            original(s3_key, local_path)
+
+        monkeypatch.setattr(s3_client, "download_file", download_file)
+        (future,) = storage.prefetch([(p64(1), tid)])
+        assert not future.done()
+
+        release.set()
+        # A load racing the prefetch waits for it instead of downloading
+        with open(storage.loadBlob(p64(1), tid), "rb") as f:
+            assert f.read() == b"blob 1"
+        future.result()
+        assert len(downloads) == 1
+
+    def test_instances_share_prefetch_pool(self, storage):
+        assert storage.new_instance()._prefetch_pool is storage._prefetch_pool
+
+
 class TestLoadPendingBlob:
     """Verify loadBlob returns pending (staged) blobs during a transaction."""
 
@@ -346,6 +690,26 @@ class TestNewInstance:
         new = storage.new_instance()
         assert new._s3_client is s3_client
         assert new._cache is blob_cache
+        assert new._upload_pool is storage._upload_pool
+        assert new._prefetch_pool is storage._prefetch_pool
+        assert new._missing is storage._missing
+
+    def test_new_instance_creates_no_thread_pools(self, storage, monkeypatch):
+        monkeypatch.setattr(concurrent.futures, "ThreadPoolExecutor", None)
+        storage.new_instance()
+
+    def test_instance_close_keeps_shared_resources(
+        self, storage, s3_client, blob_cache, monkeypatch
+    ):
+        closed = []
+        monkeypatch.setattr(s3_client, "close", lambda: closed.append("s3"))
+        monkeypatch.setattr(blob_cache, "close", lambda: closed.append("cache"))
+        new = storage.new_instance()
+
+        new.close()
+        assert closed == []
+        storage.close()
+        assert closed == ["cache", "s3"]
 
     def test_new_instance_returns_different_wrapper(self, storage):
         new = storage.new_instance()
@@ -417,6 +781,173 @@ class TestPack:
         keys_after = list(s3_client.list_objects("blobs/"))
         assert len(keys_after) == 0
 
+    def test_pack_gc_checks_each_oid_once(self, storage, s3_client, tmp_path):
+        import time
+
+        self._store_root(storage)
+        orphan_src = _make_blob_file(tmp_path, b"orphan")
+        for tid in range(3):
+            s3_client.upload_file(orphan_src, f"blobs/3e7/{tid + 1}.blob")
+        checked = []
+        original = storage._oid_loadable
+        storage._oid_loadable = lambda oid: checked.append(oid) or original(oid)
+
+        storage.pack(time.time(), lambda p: [])
+
+        assert checked == [p64(0x3E7)]
+        assert list(s3_client.list_objects("blobs/")) == []
+
+    def test_pack_gc_deletes_in_batches(
+        self, storage, s3_client, tmp_path, monkeypatch
+    ):
+        import time
+        import zodb_s3blobs.storage
+
+        self._store_root(storage)
+        orphan_src = _make_blob_file(tmp_path, b"orphan")
+        for i in range(5):
+            s3_client.upload_file(orphan_src, f"blobs/{i + 0x3E7:x}/1.blob")
+
+        monkeypatch.setattr(zodb_s3blobs.storage, "_GC_DELETE_BATCH_SIZE", 2)
+        batches = []
+        original_delete = s3_client.delete_objects
+
+        def delete_objects(keys):
+            batches.append(len(keys))
+            original_delete(keys)
+
+        s3_client.delete_objects = delete_objects
+        storage.pack(time.time(), lambda p: [])
+
+        assert sorted(batches) == [1, 2, 2]
+        assert list(s3_client.list_objects("blobs/")) == []
+
+    def test_pack_gc_deletes_batches_concurrently(
+        self, storage, s3_client, tmp_path, monkeypatch
+    ):
+        import threading
+        import time
+        import zodb_s3blobs.storage
+
+        self._store_root(storage)
+        orphan_src = _make_blob_file(tmp_path, b"orphan")
+        for i in range(4):
+            s3_client.upload_file(orphan_src, f"blobs/{i + 0x3E7:x}/1.blob")
+
+        monkeypatch.setattr(zodb_s3blobs.storage, "_GC_DELETE_BATCH_SIZE", 1)
+        # Both full batches must be in flight at once to pass the barrier
+        barrier = threading.Barrier(2, timeout=5)
+        original_delete = s3_client.delete_objects
+
+        def delete_objects(keys):
+            if threading.current_thread() is not threading.main_thread():
+                barrier.wait()
+            original_delete(keys)
+
+        s3_client.delete_objects = delete_objects
+        storage.pack(time.time(), lambda p: [])
+
+        assert list(s3_client.list_objects("blobs/")) == []
+
+    def test_pack_gc_streams_listing(self, storage, s3_client, monkeypatch):
+        import threading
+        import time
+        import zodb_s3blobs.storage
+
+        self._store_root(storage)
+        monkeypatch.setattr(zodb_s3blobs.storage, "_GC_DELETE_BATCH_SIZE", 1)
+        deleted = []
+        first_deleted = threading.Event()
+
+        def list_objects(prefix):
+            yield "blobs/3e7/1.blob"
+            # A materialized listing would never get here before deleting
+            assert first_deleted.wait(timeout=5)
+            yield "blobs/3e8/1.blob"
+
+        def delete_objects(keys):
+            deleted.extend(keys)
+            first_deleted.set()
+
+        s3_client.list_objects = list_objects
+        s3_client.delete_objects = delete_objects
+        storage.pack(time.time(), lambda p: [])
+
+        assert sorted(deleted) == ["blobs/3e7/1.blob", "blobs/3e8/1.blob"]
+
+    def test_pack_gc_delete_failure_does_not_raise(self, storage, s3_client, tmp_path):
+        import time
+
+        self._store_root(storage)
+        orphan_src = _make_blob_file(tmp_path, b"orphan")
+        s3_client.upload_file(orphan_src, "blobs/3e7/1.blob")
+        s3_client.delete_objects = lambda keys: (_ for _ in ()).throw(
+            Exception("S3 down")
+        )
+
+        storage.pack(time.time(), lambda p: [])
+
+
+class TestPackFileStorage:
+    @pytest.fixture
+    def fs_storage(self, s3_client, blob_cache, tmp_path):
+        from ZODB.FileStorage import FileStorage
+
+        base = FileStorage(str(tmp_path / "Data.fs"))
+        storage = S3BlobStorage(
+            base, s3_client, blob_cache, temp_dir=str(tmp_path / "staging")
+        )
+        yield storage
+        storage.close()
+
+    def _commit(self, storage, oid, blob_path=None):
+        from ZODB.Connection import TransactionMetaData
+
+        txn = TransactionMetaData()
+        storage.tpc_begin(txn)
+        if blob_path is None:
+            storage.store(oid, p64(0), b"root", "", txn)
+        else:
+            storage.storeBlob(oid, p64(0), b"pickle", blob_path, "", txn)
+        storage.tpc_vote(txn)
+        return storage.tpc_finish(txn)
+
+    def test_pack_uses_index_instead_of_load(
+        self, fs_storage, s3_client, tmp_path, monkeypatch
+    ):
+        import time
+        import ZODB.FileStorage
+
+        self._commit(fs_storage, p64(0))
+        self._commit(fs_storage, p64(1), _make_blob_file(tmp_path, b"keep"))
+        s3_client.upload_file(_make_blob_file(tmp_path, b"orphan"), "blobs/3e7/1.blob")
+
+        def fail_load(*args):
+            raise AssertionError("load() should not be called")
+
+        monkeypatch.setattr(ZODB.FileStorage.FileStorage, "load", fail_load)
+        fs_storage.pack(time.time(), lambda p: [p64(1)])
+
+        keys = list(s3_client.list_objects("blobs/"))
+        assert len(keys) == 1
+        assert keys[0].startswith("blobs/1/")
+
+
+class TestS3Key:
+    @pytest.mark.parametrize("n", [0, 1, 0xF, 0x10, 0x3E7, 0x100, 2**63, 2**64 - 1])
+    def test_key_format_unchanged(self, storage, n):
+        from ZODB.utils import oid_repr
+        from ZODB.utils import tid_repr
+
+        legacy_oid = oid_repr(p64(n)).removeprefix("0x").lstrip("0") or "0"
+        legacy_tid = tid_repr(p64(n)).removeprefix("0x").lstrip("0") or "0"
+        key = storage._s3_key(p64(n), p64(n))
+        assert key == f"blobs/{legacy_oid}/{legacy_tid}.blob"
+
+    def test_key_roundtrip(self, storage):
+        oid = p64(0x1A2B)
+        assert S3BlobStorage._oid_from_key(storage._s3_key(oid, p64(5))) == oid
+
 
 class TestOidFromKey:
     def test_valid_key(self):
@@ -445,6 +976,22 @@ class TestOidFromKey:
     def test_rejects_extra_segments(self):
         assert S3BlobStorage._oid_from_key("blobs/extra/1/2.blob") is None
 
+    @pytest.mark.parametrize(
+        "key",
+        [
+            "blobs//1.blob",
+            "blobs/1/.blob",
+            "blobs/1/2.blob\n",
+            "blobs/1/x2.blob",
+            "blobs/+1/2.blob",
+            "blobs/1_0/2.blob",
+            "blobs/0x1/2.blob",
+            "blobs/1/2.blob.tmp",
+        ],
+    )
+    def test_rejects_malformed_keys(self, key):
+        assert S3BlobStorage._oid_from_key(key) is None
+
     def test_valid_key_with_long_oid(self):
         oid = S3BlobStorage._oid_from_key("blobs/1a2b3c4d5e6f/abc.blob")
         assert oid is not None
@@ -486,3 +1033,18 @@ class TestClose:
 
         store.close()
         assert len(close_called) == 1
+
+    def test_close_calls_s3_client_close(self, storage, s3_client, monkeypatch):
+        close_called = []
+        monkeypatch.setattr(s3_client, "close", lambda: close_called.append(True))
+
+        storage.close()
+        assert close_called == [True]
+
+    def test_close_shuts_down_upload_pool(self, storage):
+        instance = storage.new_instance()
+        instance.close()
+        storage._upload_pool.submit(int).result()
+        storage.close()
+        with pytest.raises(RuntimeError):
+            storage._upload_pool.submit(int)
@@ -0,0 +1,38 @@
+from zodb_s3blobs._util import fast_copy
+
+import errno
+import os
+import pytest
+
+
+class TestFastCopy:
+    def test_copies_content(self, tmp_path):
+        src = tmp_path / "src.bin"
+        src.write_bytes(os.urandom(300_000))
+
+        fast_copy(str(src), str(tmp_path / "dst.bin"))
+
+        assert (tmp_path / "dst.bin").read_bytes() == src.read_bytes()
+
+    def test_falls_back_when_unsupported(self, tmp_path, monkeypatch):
+        src = tmp_path / "src.bin"
+        src.write_bytes(b"fallback")
+
+        def copy_file_range(*args):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+        monkeypatch.setattr(os, "copy_file_range", copy_file_range, raising=False)
+        fast_copy(str(src), str(tmp_path / "dst.bin"))
+
+        assert (tmp_path / "dst.bin").read_bytes() == b"fallback"
+
+    def test_real_errors_propagate(self, tmp_path, monkeypatch):
+        src = tmp_path / "src.bin"
+        src.write_bytes(b"full")
+
+        def copy_file_range(*args):
+            raise OSError(errno.ENOSPC, "No space left on device")
+
+        monkeypatch.setattr(os, "copy_file_range", copy_file_range, raising=False)
+        with pytest.raises(OSError, match=r"No space"):
+            fast_copy(str(src), str(tmp_path / "dst.bin"))